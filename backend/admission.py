@@ -0,0 +1,269 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.requests import HTTPConnection
+
+from tracing import span
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `burst` tokens."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take one token. Returns 0 on success, otherwise seconds until one is available."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """Token buckets keyed by an arbitrary hashable key (player id, npc id, ...)."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: dict = {}
+
+    def take(self, key) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    def _prune(self):
+        # A full bucket carries no state worth keeping, so idle keys can go.
+        now = time.monotonic()
+        for key in [k for k, b in self._buckets.items() if b.is_full(now)]:
+            del self._buckets[key]
+
+
+class FairQueue:
+    """
+    Bounded concurrency gate for LLM-bound work.
+
+    At most `max_active` holders run at once and at most `max_queued` wait.
+    Waiters are grouped by client and, within a client, by player. Slots go
+    round-robin across clients and, inside each client, round-robin across
+    its players, so neither a chatty client nor one player behind a shared
+    address (e.g. every user of the Streamlit app) can starve the rest.
+    """
+
+    def __init__(self, max_active: int, max_queued: int):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self._active = 0
+        self._queued = 0
+        # client -> player -> waiting futures
+        self._waiters: OrderedDict = OrderedDict()
+
+    @property
+    def full(self) -> bool:
+        return self._queued >= self.max_queued
+
+    async def acquire(self, client, player=None):
+        if self._active < self.max_active and not self._queued:
+            self._active += 1
+            return
+        if self.full:
+            raise QueueFull()
+
+        future = asyncio.get_running_loop().create_future()
+        players = self._waiters.setdefault(client, OrderedDict())
+        players.setdefault(player, deque()).append(future)
+        self._queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just as we got cancelled.
+                self.release()
+            else:
+                self._discard(client, player, future)
+            raise
+
+    def release(self):
+        while self._waiters:
+            client, players = self._waiters.popitem(last=False)
+            player, waiters = players.popitem(last=False)
+            future = waiters.popleft()
+            # Re-append the player and the client at the back for fairness.
+            if waiters:
+                players[player] = waiters
+            if players:
+                self._waiters[client] = players
+            self._queued -= 1
+            if not future.done():
+                # Hand the slot straight over; `_active` stays unchanged.
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _discard(self, client, player, future):
+        players = self._waiters.get(client)
+        waiters = players.get(player) if players else None
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._queued -= 1
+            if not waiters:
+                del players[player]
+            if not players:
+                del self._waiters[client]
+
+
+class QueueFull(Exception):
+    pass
+
+
+def client_address(connection: HTTPConnection) -> str:
+    """
+    The caller's address. Behind a proxy listed in TRUSTED_PROXIES ("*" for
+    any), the nearest X-Forwarded-For hop that isn't a trusted proxy.
+    """
+    host = connection.client.host if connection.client else ""
+    if not _trusted(host):
+        return host
+    hops = connection.headers.get("x-forwarded-for", "").split(",")
+    hops = [hop.strip() for hop in hops if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+    return hops[0] if hops else host
+
+
+def _trusted(host: str) -> bool:
+    return "*" in TRUSTED_PROXIES or host in TRUSTED_PROXIES
+
+
+class AdmissionController:
+    """
+    Per-player and per-NPC rate limits, and an optional per-client one, in
+    front of a fair, bounded LLM queue. Background work (pre-generation) has
+    its own `max_background` slots, so at most `max_active + max_background`
+    LLM calls are in flight per worker process.
+
+    Player ids are chosen by the caller, so they are only trusted within a
+    client address: player buckets and queue lanes are per (client, player),
+    and the client bucket, when enabled, caps an address however many ids
+    it makes up. Leave it off when many players share an address.
+    """
+
+    def __init__(
+        self,
+        player_rate: float,
+        player_burst: float,
+        npc_rate: float,
+        npc_burst: float,
+        max_active: int,
+        max_queued: int,
+        client_rate: Optional[float] = None,
+        client_burst: Optional[float] = None,
+        max_background: int = 2,
+        retry_after: int = 1,
+    ):
+        self.clients = (
+            RateLimiter(client_rate, client_burst or client_rate)
+            if client_rate
+            else None
+        )
+        self.players = RateLimiter(player_rate, player_burst)
+        self.npcs = RateLimiter(npc_rate, npc_burst)
+        self.queue = FairQueue(max_active, max_queued)
+        self.background = threading.BoundedSemaphore(max_background)
+        self.retry_after = retry_after
+
+    def check_rate(self, client: str, player_id: str, npc_id: int):
+        """Raise a 429 with Retry-After if the client, player or NPC is over its limit."""
+        limits = [
+            (self.players, (client, player_id), "Player"),
+            (self.npcs, npc_id, "NPC"),
+        ]
+        if self.clients is not None:
+            limits.insert(0, (self.clients, client, "Client"))
+        for limiter, key, what in limits:
+            wait = limiter.take(key)
+            if wait:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"{what} rate limit exceeded",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+
+    @asynccontextmanager
+    async def llm_slot(self, client: str, player_id: str = None):
+        """Hold one LLM slot, or fail fast with a 503 if the queue is full."""
+        try:
+            with span("llm_queue"):
+                await self.queue.acquire(client, player_id)
+        except QueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        try:
+            yield
+        finally:
+            self.queue.release()
+
+    @contextmanager
+    def background_slot(self):
+        """Hold one background LLM slot, waiting (in this thread) for one to free up."""
+        with span("llm_queue"):
+            self.background.acquire()
+        try:
+            yield
+        finally:
+            self.background.release()
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+# Proxies whose X-Forwarded-For is believed, e.g. the hosting platform's
+TRUSTED_PROXIES = {
+    host.strip() for host in os.getenv("TRUSTED_PROXIES", "").split(",") if host.strip()
+}
+
+# Admission control for LLM-bound requests
+admission = AdmissionController(
+    player_rate=float(os.getenv("PLAYER_RATE_PER_SEC", "0.5")),
+    player_burst=float(os.getenv("PLAYER_BURST", "5")),
+    npc_rate=float(os.getenv("NPC_RATE_PER_SEC", "2")),
+    npc_burst=float(os.getenv("NPC_BURST", "10")),
+    max_active=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    max_queued=int(os.getenv("LLM_MAX_QUEUED", "32")),
+    # Off unless set: every Streamlit user shares the Streamlit server's address
+    client_rate=_env_float("CLIENT_RATE_PER_SEC"),
+    client_burst=_env_float("CLIENT_BURST"),
+    # Shared by every job thread, whatever their own concurrency setting
+    max_background=int(os.getenv("LLM_BACKGROUND_CONCURRENCY", "2")),
+)
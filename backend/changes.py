@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+
+import orjson
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+from db import get_db_cursor
+from responses import fast_response
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/npc/changes")
+
+CHANGE_COLUMNS = ("version", "npc_id", "op", "npc", "changed_at")
+
+# Serializes change-log writers so versions become visible in commit order
+# and a reader can never skip a version that commits late.
+CHANGE_LOCK_ID = 0x4E5043  # "NPC"
+
+POLL_SECONDS = float(os.getenv("CHANGE_POLL_SECONDS", "1"))
+MAX_BATCH = 1000
+
+
+def record_changes(cursor, op: str, npc_ids):
+    """
+    Log `op` ("create", "update" or "delete") for `npc_ids` inside the
+    caller's transaction. Creates and updates carry the NPC row as it is now.
+    """
+    if not npc_ids:
+        return
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CHANGE_LOCK_ID,))
+    if op == "delete":
+        cursor.execute(
+            "INSERT INTO npc_changes (npc_id, op) SELECT unnest(%s::int[]), 'delete'",
+            (list(npc_ids),),
+        )
+    else:
+        cursor.execute(
+            """
+            INSERT INTO npc_changes (npc_id, op, npc)
+            SELECT n.id, %s, to_jsonb(n) FROM npcs n WHERE n.id = ANY(%s) ORDER BY n.id
+            """,
+            (op, list(npc_ids)),
+        )
+
+
+def fetch_changes(since: int, limit: int = MAX_BATCH) -> list:
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {', '.join(CHANGE_COLUMNS)} FROM npc_changes
+            WHERE version > %s ORDER BY version LIMIT %s
+            """,
+            (since, limit),
+        )
+        return [dict(zip(CHANGE_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def head_version(cursor) -> int:
+    """
+    Newest change-log version. Writers commit in version order, so every
+    change up to it is visible; read it before a snapshot and resume from it.
+    """
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM npc_changes")
+    return cursor.fetchone()[0]
+
+
+def latest_version() -> int:
+    with get_db_cursor() as cursor:
+        return head_version(cursor)
+
+
+class ChangeFeed:
+    """
+    One poller per worker fans new changes out to every push subscriber,
+    so the database sees a single query per interval however many mirrors
+    are connected.
+    """
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._task = None
+        self._start_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    async def subscribe(self) -> asyncio.Queue:
+        """
+        Register a subscriber. Everything after the returned point in time is
+        delivered on the queue; the subscriber reads any earlier backlog itself.
+        """
+        queue = asyncio.Queue(self.max_pending)
+        async with self._start_lock:
+            if self._task is None or self._task.done():
+                # Start fanning out from the current head, before the new
+                # subscriber reads its backlog, so the two always overlap
+                last = await run_in_threadpool(latest_version)
+                self._task = asyncio.create_task(self._poll(last))
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def notify(self):
+        """Poll now rather than at the next interval, e.g. after a local write."""
+        self._wakeup.set()
+
+    async def _poll(self, last: int):
+        while self._subscribers:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                changes = await run_in_threadpool(fetch_changes, last)
+            except Exception as e:
+                logger.warning("Change feed poll failed: %s", e)
+                continue
+            if not changes:
+                continue
+            last = changes[-1]["version"]
+            for queue in list(self._subscribers):
+                try:
+                    queue.put_nowait(changes)
+                except asyncio.QueueFull:
+                    # Too far behind; drop it and let it resume with ?since=
+                    self._subscribers.discard(queue)
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+
+feed = ChangeFeed()
+
+
+@router.get("")
+async def get_changes(request: Request, since: int = 0, limit: int = MAX_BATCH):
+    """
+    Changes after version `since`, oldest first. Resume with the returned
+    `version`; bootstrap from since=0 or from the `version` of /npc/list.
+    """
+    limit = max(1, min(limit, MAX_BATCH))
+    changes = await run_in_threadpool(fetch_changes, since, limit)
+    return fast_response(
+        request,
+        {
+            "changes": changes,
+            "version": changes[-1]["version"] if changes else since,
+            "has_more": len(changes) == limit,
+        },
+    )
+
+
+@router.websocket("/ws")
+async def push_changes(websocket: WebSocket, since: int = 0):
+    """
+    Push variant of GET /npc/changes: sends the backlog after `since`, then
+    each new batch as `{"changes": [...], "version": N}`. If the client falls
+    too far behind the socket is closed and it should reconnect with `since`.
+    """
+    await websocket.accept()
+    # Subscribe before reading the backlog so nothing slips in between
+    try:
+        queue = await feed.subscribe()
+    except Exception:
+        logger.exception("Could not subscribe to the change feed")
+        await websocket.close(code=1013, reason="Change feed unavailable")
+        return
+    last = since
+    try:
+        while True:
+            backlog = await run_in_threadpool(fetch_changes, last)
+            if not backlog:
+                break
+            last = backlog[-1]["version"]
+            await websocket.send_text(_encode(backlog, last))
+        while True:
+            changes = await queue.get()
+            if changes is None:
+                await websocket.close(code=1013, reason="Subscriber too slow")
+                return
+            changes = [change for change in changes if change["version"] > last]
+            if changes:
+                last = changes[-1]["version"]
+                await websocket.send_text(_encode(changes, last))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        feed.unsubscribe(queue)
+
+
+def _encode(changes: list, version: int) -> str:
+    return orjson.dumps({"changes": changes, "version": version}).decode()
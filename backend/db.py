@@ -0,0 +1,204 @@
+from fastapi import HTTPException
+import logging
+import os
+import threading
+import time
+from psycopg2 import extensions, pool
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from persona import NPC_COLUMNS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Hot-path statements, prepared on each pooled connection the first time they
+# run there. Run them with `execute_prepared(cursor, name, params)`. List
+# columns explicitly: a prepared `SELECT *` breaks when the table changes.
+PREPARED_STATEMENTS = {
+    "select_npc": f"SELECT {', '.join(NPC_COLUMNS)} FROM npcs WHERE id = $1",
+    "insert_interaction": """
+        INSERT INTO interactions
+            (npc_id, player_input, npc_response, persona_version, prompt_tokens, cached_tokens,
+             thread_id, player_id)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    """,
+    "latest_interactions": """
+        SELECT player_input, npc_response FROM interactions
+        WHERE npc_id = $1
+        ORDER BY id DESC
+        LIMIT $2
+    """,
+    "thread_interactions": """
+        SELECT player_input, npc_response FROM interactions
+        WHERE thread_id = $1
+        ORDER BY id DESC
+        LIMIT $2
+    """,
+    "select_thread": """
+        SELECT id, npc_id, player_id, created_at, last_active_at FROM threads
+        WHERE id = $1
+    """,
+    "touch_thread": "UPDATE threads SET last_active_at = NOW() WHERE id = $1",
+    "pregenerated_line": """
+        SELECT line FROM npc_lines
+        WHERE npc_id = $1 AND persona_version = $2 AND kind = $3
+        ORDER BY random()
+        LIMIT 1
+    """,
+}
+
+# Bound how long a connect may block, and how often a dead database is retried
+CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+RETRY_MAX_SECONDS = float(os.getenv("DB_RETRY_MAX_SECONDS", "30"))
+
+_connection_pool = None
+_pool_lock = threading.Lock()
+_retry_at = 0.0
+_retry_delay = 0.0
+
+
+def get_db_config():
+    """Read the database configuration from the environment."""
+    database_url = os.getenv("POSTGRESQL_EXTERNAL_URL") or os.getenv("DATABASE_URL")
+    if database_url:
+        # Parse the DATABASE_URL
+        result = urlparse(database_url)
+        return {
+            "dbname": result.path[1:],
+            "user": result.username,
+            "password": result.password,
+            "host": result.hostname,
+            "port": result.port or 5432,
+            "connect_timeout": CONNECT_TIMEOUT,
+        }
+    logger.warning("Neither POSTGRESQL_EXTERNAL_URL nor DATABASE_URL is set")
+    # Fallback to individual environment variables
+    return {
+        "dbname": os.getenv("POSTGRES_DATABASE"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "connect_timeout": CONNECT_TIMEOUT,
+    }
+
+
+class PreparedConnection(extensions.connection):
+    """Connection that remembers which PREPARED_STATEMENTS it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute_prepared(cursor, name: str, params=()):
+    """Run a PREPARED_STATEMENTS entry, preparing it on this connection first if needed."""
+    connection = cursor.connection
+    if name not in connection.prepared:
+        try:
+            cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        except Exception as e:
+            logger.error("Could not prepare statement %s: %s", name, e)
+            raise
+        # Prepared statements outlive the transaction, even a rolled-back one
+        connection.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def get_pool():
+    """
+    Return the connection pool, creating it on first use. After a failed
+    attempt, callers fail fast until an exponentially growing delay passes.
+    """
+    global _connection_pool, _retry_at, _retry_delay
+    if _connection_pool is None:
+        with _pool_lock:
+            if _connection_pool is None:
+                if time.monotonic() < _retry_at:
+                    raise ConnectionError("Database unavailable, retry pending")
+                db_config = get_db_config()
+                logger.info(
+                    "Connecting to database at %s:%s/%s",
+                    db_config["host"],
+                    db_config["port"],
+                    db_config["dbname"],
+                )
+                try:
+                    _connection_pool = pool.ThreadedConnectionPool(
+                        int(os.getenv("DB_POOL_MIN", "1")),
+                        int(os.getenv("DB_POOL_MAX", "20")),
+                        connection_factory=PreparedConnection,
+                        **db_config,
+                    )
+                except Exception:
+                    _retry_delay = min(RETRY_MAX_SECONDS, _retry_delay * 2 or 1)
+                    _retry_at = time.monotonic() + _retry_delay
+                    raise
+                _retry_delay = 0.0
+    return _connection_pool
+
+
+def warmup():
+    """Open and check DB_POOL_WARM connections so first requests skip the connect cost."""
+    connection_pool = get_pool()
+    connections = []
+    try:
+        for _ in range(int(os.getenv("DB_POOL_WARM", "4"))):
+            connection = connection_pool.getconn()
+            connections.append(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+    finally:
+        for connection in connections:
+            connection_pool.putconn(connection)
+
+
+def ping():
+    """Round-trip a trivial query; raises if the database is unreachable."""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def close_pool():
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.closeall()
+            _connection_pool = None
+
+
+@contextmanager
+def get_db_connection():
+    """Get a database connection from the pool."""
+    try:
+        with span("db_acquire"):
+            connection_pool = get_pool()
+            connection = connection_pool.getconn()
+    except Exception as e:
+        logger.error("Error getting connection from pool: %s", e)
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    try:
+        yield connection
+    except Exception:
+        # Don't hand a connection with an aborted transaction to the next caller
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        connection_pool.putconn(connection, close=bool(connection.closed))
+
+
+@contextmanager
+def get_db_cursor(commit=False):
+    """Get a database cursor using a connection from the pool."""
+    with get_db_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            if commit:
+                connection.commit()
+        finally:
+            cursor.close()
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import orjson
+from fastapi import HTTPException, Response
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future = asyncio.get_running_loop().create_future()
+        self.expires_at = None  # Set once the original request has completed
+
+
+class IdempotencyStore:
+    """
+    Results of completed requests keyed by (scope, Idempotency-Key) for `ttl`
+    seconds. A replay gets the stored result; a duplicate that arrives while
+    the original is still running waits for it. Failed requests aren't kept,
+    so they can be retried with the same key.
+    """
+
+    def __init__(self, ttl: float, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries: OrderedDict = OrderedDict()
+
+    def _expire(self):
+        # Completed entries are moved to the end, so they sit in expiry order
+        now = time.monotonic()
+        while self._entries:
+            k, entry = next(iter(self._entries.items()))
+            if entry.expires_at is None:
+                break
+            if entry.expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[k]
+
+    async def run(self, scope: str, key: str, fingerprint: str, fn):
+        """Return `(result, replayed)`, calling `fn()` at most once per live key."""
+        k = (scope, key)
+        while True:
+            self._expire()
+            entry = self._entries.get(k)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used for a different request",
+                )
+            await asyncio.wait({entry.future})
+            if not entry.future.cancelled() and entry.future.exception() is None:
+                return entry.future.result(), True
+            # The original failed; take over as the new original
+
+        entry = self._entries[k] = _Entry(fingerprint)
+        try:
+            result = await fn()
+        except BaseException as e:
+            del self._entries[k]
+            if isinstance(e, Exception):
+                entry.future.set_exception(e)
+                # Waiters retry on their own; don't warn if nobody was waiting
+                entry.future.exception()
+            else:
+                entry.future.cancel()
+            raise
+        entry.future.set_result(result)
+        entry.expires_at = time.monotonic() + self.ttl
+        self._entries.move_to_end(k)
+        return result, False
+
+
+store = IdempotencyStore(
+    ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+    max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+)
+
+
+async def idempotent(response: Response, scope: str, key, payload, fn):
+    """Run `fn()` under an optional Idempotency-Key, flagging replays in the response."""
+    if not key:
+        return await fn()
+    fingerprint = hashlib.sha256(orjson.dumps(payload)).hexdigest()
+    result, replayed = await store.run(scope, key, fingerprint, fn)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
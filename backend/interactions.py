@@ -0,0 +1,216 @@
+import logging
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+import llm
+from admission import admission
+from db import execute_prepared, get_db_connection
+from persona import HISTORY_WINDOW, build_messages, compile_persona, npc_from_row
+from pregen import pregenerated_line
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+THREAD_COLUMNS = ("id", "npc_id", "player_id", "created_at", "last_active_at")
+
+
+def create_thread(cursor, npc_id: int, player_id: str) -> dict:
+    cursor.execute(
+        f"""
+        INSERT INTO threads (npc_id, player_id) VALUES (%s, %s)
+        RETURNING {', '.join(THREAD_COLUMNS)}
+        """,
+        (npc_id, player_id),
+    )
+    return dict(zip(THREAD_COLUMNS, cursor.fetchone()))
+
+
+def get_thread(cursor, thread_id: int) -> Optional[dict]:
+    execute_prepared(cursor, "select_thread", (thread_id,))
+    row = cursor.fetchone()
+    return dict(zip(THREAD_COLUMNS, row)) if row else None
+
+
+def latest_thread(cursor, npc_id: int, player_id: str) -> Optional[dict]:
+    """The player's most recently active thread with an NPC, if any."""
+    cursor.execute(
+        f"""
+        SELECT {', '.join(THREAD_COLUMNS)} FROM threads
+        WHERE player_id = %s AND npc_id = %s
+        ORDER BY last_active_at DESC
+        LIMIT 1
+        """,
+        (player_id, npc_id),
+    )
+    row = cursor.fetchone()
+    return dict(zip(THREAD_COLUMNS, row)) if row else None
+
+
+def resolve_thread(
+    cursor, npc_id: int, player_id: str, thread_id: int = None
+) -> Optional[dict]:
+    """
+    `thread_id` if it is the player's thread with the NPC (else None); without
+    one, the player's most recently active thread, started if there is none.
+    """
+    if thread_id is not None:
+        thread = get_thread(cursor, thread_id)
+        if thread and (thread["npc_id"], thread["player_id"]) == (npc_id, player_id):
+            return thread
+        return None
+    return latest_thread(cursor, npc_id, player_id) or create_thread(
+        cursor, npc_id, player_id
+    )
+
+
+def save_interaction(
+    cursor,
+    npc_id: int,
+    player_input: str,
+    npc_response: str,
+    persona_version: int,
+    usage: dict,
+    player_id: str = None,
+    thread_id: int = None,
+):
+    """Insert a turn (caller commits), bumping its thread's last activity."""
+    execute_prepared(
+        cursor,
+        "insert_interaction",
+        (
+            npc_id,
+            player_input,
+            npc_response,
+            persona_version,
+            usage.get("prompt_tokens"),
+            usage.get("cached_tokens"),
+            thread_id,
+            player_id,
+        ),
+    )
+    if thread_id is not None:
+        execute_prepared(cursor, "touch_thread", (thread_id,))
+
+
+def load_history(cursor, thread_id: int, limit=HISTORY_WINDOW):
+    """A thread's latest (player_input, npc_response) turns, newest first."""
+    execute_prepared(cursor, "thread_interactions", (thread_id, limit))
+    return cursor.fetchall()
+
+
+def _open_turn(npc_id: int, player_id: str, player_input: str, thread_id=None):
+    """
+    Read the NPC, the player's thread and its history. An opening turn is
+    answered with a pre-generated greeting when there is one, recorded like
+    any other turn so later replies know of it. Returns (npc, thread_id,
+    turns, greeting).
+    """
+    with get_db_connection() as connection:
+        # Fetch NPC and its recent history from the database
+        cursor = connection.cursor()
+        with span("db_select"):
+            execute_prepared(cursor, "select_npc", (npc_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="NPC not found")
+            npc = npc_from_row(row)
+            thread = resolve_thread(cursor, npc_id, player_id, thread_id)
+            if not thread:
+                raise HTTPException(status_code=404, detail="Thread not found")
+            turns = load_history(cursor, thread["id"])
+            # Keep a thread started just now
+            connection.commit()
+        greeting = None
+        if not turns and not player_input.strip():
+            greeting = pregenerated_line(cursor, npc)
+            if greeting:
+                with span("db_insert"):
+                    save_interaction(
+                        cursor,
+                        npc_id,
+                        player_input,
+                        greeting,
+                        npc["persona_version"],
+                        {},
+                        player_id,
+                        thread["id"],
+                    )
+                    connection.commit()
+    return npc, thread["id"], turns, greeting
+
+
+def _record_turn(*args):
+    """`save_interaction(cursor, *args)` on a pooled connection, committed."""
+    with get_db_connection() as connection:
+        # Insert interaction into the database
+        cursor = connection.cursor()
+        with span("db_insert"):
+            save_interaction(cursor, *args)
+            connection.commit()
+
+
+async def interact(
+    client: str,
+    npc_id: int,
+    player_id: str,
+    player_input: str,
+    prompt_context: Optional[str] = None,
+    thread_id: int = None,
+):
+    """
+    One player turn: persona and history in, NPC reply out, turn persisted.
+    Only the history of the player's thread is used: `thread_id`, or their
+    latest thread with the NPC.
+    """
+    # Callers check idempotency first so replays don't spend rate-limit tokens
+    admission.check_rate(client, player_id, npc_id)
+    try:
+        # psycopg2 blocks, so database work runs off the event loop
+        npc, thread_id, turns, greeting = await run_in_threadpool(
+            _open_turn, npc_id, player_id, player_input, thread_id
+        )
+        if greeting:
+            return {"npc_response": greeting}
+
+        # Stable persona prefix first; history, prompt_context and input last
+        persona_version, prefix = compile_persona(npc)
+        messages = build_messages(
+            prefix, reversed(turns), player_input, context=prompt_context
+        )
+        # No pool connection is held while queued for or waiting on the model
+        async with admission.llm_slot(client, player_id):
+            with span("llm"):
+                response = await llm.complete(messages)
+        npc_response = (
+            response.choices[0].message.content.strip()
+            if response.choices[0].message.content
+            else ""
+        )
+        usage = llm.token_counts(response.usage)
+        logger.info(
+            "npc=%s persona_version=%s prompt_tokens=%s cached_tokens=%s",
+            npc_id,
+            persona_version,
+            usage["prompt_tokens"],
+            usage["cached_tokens"],
+        )
+
+        await run_in_threadpool(
+            _record_turn,
+            npc_id,
+            player_input,
+            npc_response,
+            persona_version,
+            usage,
+            player_id,
+            thread_id,
+        )
+        return {"npc_response": npc_response}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error during interaction: {str(e)}"
+        )
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import APIRouter, Body, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from psycopg2.extras import Json
+
+from db import get_db_cursor
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs")
+
+# Registered job handlers, keyed by job kind
+JOB_HANDLERS = {}
+
+JOB_COLUMNS = (
+    "id",
+    "kind",
+    "params",
+    "status",
+    "progress",
+    "total",
+    "error",
+    "cancel_requested",
+    "created_at",
+    "updated_at",
+)
+
+executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("JOB_WORKERS", "2")), thread_name_prefix="job"
+)
+
+# Unfinished jobs are touched every heartbeat by the process that owns them;
+# one untouched for JOB_STALE_SECONDS lost its process and is failed.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+
+# Ids of jobs submitted by this process that haven't finished yet
+_live_jobs = set()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to job handlers for reporting progress and honouring cancellation."""
+
+    def __init__(self, job_id: int, params: dict):
+        self.job_id = job_id
+        self.params = params
+        self.chunk_size = int(
+            params.get("chunk_size") or os.getenv("JOB_CHUNK_SIZE", "500")
+        )
+
+    def progress(self, done: int, total: int = None):
+        """Record progress and raise JobCancelled if a cancel was requested."""
+        with get_db_cursor(commit=True) as cursor:
+            cursor.execute(
+                """
+                UPDATE jobs SET progress = %s, total = COALESCE(%s, total), updated_at = NOW()
+                WHERE id = %s
+                RETURNING cancel_requested
+                """,
+                (done, total, self.job_id),
+            )
+            (cancel_requested,) = cursor.fetchone()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+def job(kind: str):
+    """Register a handler `fn(ctx: JobContext)` for a job kind."""
+
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+def _set_status(job_id: int, status: str, error: str = None):
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "UPDATE jobs SET status = %s, error = %s, updated_at = NOW() WHERE id = %s",
+            (status, error, job_id),
+        )
+
+
+def _run(job_id: int, kind: str, params: dict):
+    try:
+        ctx = JobContext(job_id, params)
+        # Honour a cancel that arrived while the job was still queued
+        ctx.progress(0)
+        _set_status(job_id, "running")
+        JOB_HANDLERS[kind](ctx)
+        _set_status(job_id, "succeeded")
+    except JobCancelled:
+        _set_status(job_id, "cancelled")
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job_id, kind)
+        _set_status(job_id, "failed", str(e))
+    finally:
+        _live_jobs.discard(job_id)
+
+
+def submit_job(kind: str, params: dict = None) -> int:
+    """Persist a job and schedule it on the background executor."""
+    if kind not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+    params = params or {}
+    chunk_size = params.get("chunk_size")
+    if chunk_size is not None and (type(chunk_size) is not int or chunk_size <= 0):
+        raise HTTPException(
+            status_code=400, detail="chunk_size must be a positive integer"
+        )
+    with span("db_insert"), get_db_cursor(commit=True) as cursor:
+        cursor.execute(
+            "INSERT INTO jobs (kind, params) VALUES (%s, %s) RETURNING id",
+            (kind, Json(params)),
+        )
+        (job_id,) = cursor.fetchone()
+    _live_jobs.add(job_id)
+    executor.submit(_run, job_id, kind, params)
+    return job_id
+
+
+def heartbeat():
+    """Touch this process's unfinished jobs and fail those orphaned by a restart."""
+    with get_db_cursor(commit=True) as cursor:
+        if _live_jobs:
+            cursor.execute(
+                """
+                UPDATE jobs SET updated_at = NOW()
+                WHERE id = ANY(%s) AND status IN ('queued', 'running')
+                """,
+                (list(_live_jobs),),
+            )
+        cursor.execute(
+            """
+            UPDATE jobs SET status = 'failed', error = 'Interrupted by a worker restart',
+                updated_at = NOW()
+            WHERE status IN ('queued', 'running')
+                AND updated_at < NOW() - make_interval(secs => %s)
+            RETURNING id
+            """,
+            (JOB_STALE_SECONDS,),
+        )
+        orphaned = [row[0] for row in cursor.fetchall()]
+    if orphaned:
+        logger.warning("Marked orphaned jobs as failed: %s", orphaned)
+
+
+async def monitor():
+    """Run `heartbeat` from startup on, every JOB_HEARTBEAT_SECONDS."""
+    while True:
+        try:
+            await run_in_threadpool(heartbeat)
+        except Exception as e:
+            logger.warning("Job heartbeat failed: %s", e)
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+
+
+@router.post("", status_code=202)
+def create_job(kind: str = Body(..., embed=True), params: dict = Body({}, embed=True)):
+    return {"job_id": submit_job(kind, params)}
+
+
+@router.get("")
+def list_jobs(limit: int = 20):
+    with span("db_select"), get_db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs ORDER BY id DESC LIMIT %s",
+            (limit,),
+        )
+        rows = cursor.fetchall()
+    return {"jobs": [dict(zip(JOB_COLUMNS, row)) for row in rows]}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: int):
+    with span("db_select"), get_db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = %s", (job_id,)
+        )
+        row = cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return dict(zip(JOB_COLUMNS, row))
+
+
+@router.post("/{job_id}/cancel", status_code=202)
+def cancel_job(job_id: int):
+    # The worker notices the flag at its next progress report
+    with span("db_update"), get_db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs SET cancel_requested = TRUE, updated_at = NOW()
+            WHERE id = %s AND status IN ('queued', 'running')
+            """,
+            (job_id,),
+        )
+        updated = cursor.rowcount
+    if not updated:
+        raise HTTPException(status_code=409, detail="Job is not running")
+    return {"message": "Cancellation requested"}
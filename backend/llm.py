@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+MODEL = "gpt-4o-mini"
+
+# Prewarming is best effort: give up quickly rather than hold up readiness
+PREWARM_TIMEOUT = float(os.getenv("LLM_PREWARM_TIMEOUT", "5"))
+
+_client = None
+_sync_client = None
+_prewarm_task = None
+ready = False
+
+
+def get_client() -> openai.AsyncOpenAI:
+    """Return the shared OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+
+def get_sync_client() -> openai.OpenAI:
+    """Blocking client for batch work running outside the event loop."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _sync_client
+
+
+async def prewarm() -> bool:
+    """Open the client's HTTP connection pool ahead of the first completion."""
+    global ready
+    try:
+        client = get_client().with_options(timeout=PREWARM_TIMEOUT, max_retries=0)
+        await client.models.retrieve(MODEL)
+        ready = True
+    except Exception as e:
+        logger.warning("LLM prewarm failed: %s", e)
+    return ready
+
+
+def prewarm_in_background():
+    """Start a prewarm unless the client is warm or one is already running."""
+    global _prewarm_task
+    if not ready and (_prewarm_task is None or _prewarm_task.done()):
+        _prewarm_task = asyncio.create_task(prewarm())
+
+
+async def complete(messages, max_tokens=150):
+    return await get_client().chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+    )
+
+
+def complete_sync(messages, max_tokens=150, **kwargs):
+    return get_sync_client().chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        **kwargs,
+    )
+
+
+async def stream(messages, max_tokens=150, usage: dict = None):
+    """Yield the completion text as it arrives; fills `usage` once it's done."""
+    chunks = await get_client().chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in chunks:
+        if chunk.usage and usage is not None:
+            usage.update(token_counts(chunk.usage))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def token_counts(usage) -> dict:
+    """Prompt and provider-cached prompt token counts from a usage block."""
+    if usage is None:
+        return {"prompt_tokens": None, "cached_tokens": None}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None),
+    }
+
+
+async def close():
+    global _client, ready
+    if _client is not None:
+        await _client.close()
+        _client = None
+        ready = False
@@ -1,88 +1,74 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import openai
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
-import psycopg2
-from psycopg2 import pool
-from contextlib import contextmanager
-from urllib.parse import urlparse
+from typing import Optional
 
-app = FastAPI()
-
-# Load environment variables from .env
+# Load environment variables from .env before the modules below read them
 load_dotenv()
 
-# Database configuration
-DATABASE_URL = os.getenv("POSTGRESQL_EXTERNAL_URL") or os.getenv("DATABASE_URL")
-
-if not DATABASE_URL:
-    print("Warning: Neither POSTGRESQL_EXTERNAL_URL nor DATABASE_URL is set")
-
-if DATABASE_URL:
-    # Parse the DATABASE_URL
-    result = urlparse(DATABASE_URL)
-    db_config = {
-        "dbname": result.path[1:],
-        "user": result.username,
-        "password": result.password,
-        "host": result.hostname,
-        "port": result.port or 5432,
-    }
-else:
-    # Fallback to individual environment variables
-    db_config = {
-        "dbname": os.getenv("POSTGRES_DATABASE"),
-        "user": os.getenv("POSTGRES_USER"),
-        "password": os.getenv("POSTGRES_PASSWORD"),
-        "host": os.getenv("POSTGRES_HOST"),
-        "port": os.getenv("POSTGRES_PORT", "5432"),
-    }
-
-print(
-    f"Attempting to connect to database at {db_config['host']}:{db_config['port']}/{db_config['dbname']}"
+import db
+import llm
+import sessions
+from admission import client_address
+from db import execute_prepared, get_db_connection, get_db_cursor
+from responses import rows_response
+from idempotency import idempotent
+from changes import feed, head_version, record_changes, router as changes_router
+from tracing import server_timing, span
+from profiler import router as profiler_router
+from jobs import (
+    JobContext,
+    job,
+    monitor as monitor_jobs,
+    router as jobs_router,
+    submit_job,
 )
+from pregen import router as pregen_router
+from persona import NPC_COLUMNS, invalidate as invalidate_persona
+from interactions import interact
+from threads import router as threads_router
 
-# Create a connection pool
-try:
-    connection_pool = psycopg2.pool.SimpleConnectionPool(1, 20, **db_config)
-    print("Connection pool created successfully")
-except Exception as e:
-    print(f"Error creating connection pool: {e}")
-    connection_pool = None
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 
-@contextmanager
-def get_db_connection():
-    """Get a database connection from the pool."""
-    connection = None
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm shared resources before the worker reports ready; the LLM client
+    # warms in the background. Failures are logged rather than fatal: /readyz
+    # stays red until they recover.
     try:
-        connection = connection_pool.getconn()
-        yield connection
+        await run_in_threadpool(db.warmup)
     except Exception as e:
-        print(f"Error getting connection from pool: {e}")
-        raise HTTPException(status_code=500, detail="Database connection error")
-    finally:
-        if connection:
-            connection_pool.putconn(connection)
-
-
-@contextmanager
-def get_db_cursor(commit=False):
-    """Get a database cursor using a connection from the pool."""
-    with get_db_connection() as connection:
-        cursor = connection.cursor()
-        try:
-            yield cursor
-            if commit:
-                connection.commit()
-        finally:
-            cursor.close()
-
-
-# Set your OpenAI API key here
-load_dotenv()  # Load environment variables from .env file
-openai.api_key = os.getenv("OPENAI_API_KEY")
+        logger.error("Database warmup failed: %s", e)
+    llm.prewarm_in_background()
+    tasks = [
+        asyncio.create_task(sessions.store.sweep()),
+        asyncio.create_task(sessions.store.follow_changes()),
+        asyncio.create_task(monitor_jobs()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await sessions.store.drain()
+    await llm.close()
+    db.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(jobs_router)
+app.include_router(sessions.router)
+app.include_router(profiler_router)
+app.include_router(pregen_router)
+app.include_router(changes_router)
+app.include_router(threads_router)
+app.middleware("http")(server_timing)
 
 
 class NPC(BaseModel):
@@ -95,22 +81,61 @@ class NPC(BaseModel):
     appearance: str
 
 
+def schedule_pregeneration(npc_id: int):
+    """Queue greeting/bark/idle generation for an NPC's current persona."""
+    try:
+        submit_job("pregenerate_lines", {"npc_ids": [npc_id]})
+    except Exception as e:
+        # The NPC change is already committed; lines can be backfilled later
+        logger.warning("Could not schedule line generation for NPC %s: %s", npc_id, e)
+
+
 @app.get("/")
 @app.head("/")
 async def root():
     return {"message": "Welcome to the NPC Soul App!"}
 
 
-@app.post("/npc/create")
-async def create_npc(npc: NPC):
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the database answers and the LLM client is warm."""
+    checks = {"database": True, "llm": llm.ready}
+    if not llm.ready:
+        # Report now; a later probe sees the outcome
+        llm.prewarm_in_background()
     try:
-        with get_db_connection() as connection:
-            # Insert NPC into the database
-            cursor = connection.cursor()
+        await run_in_threadpool(db.ping)
+    except Exception:
+        checks["database"] = False
+    status_code = 200 if all(checks.values()) else 503
+    return JSONResponse(status_code=status_code, content=checks)
+
+
+@app.post("/npc/create")
+async def create_npc(
+    npc: NPC, response: Response, idempotency_key: Optional[str] = Header(None)
+):
+    return await idempotent(
+        response, "create", idempotency_key, npc.model_dump(), lambda: _create_npc(npc)
+    )
+
+
+def _insert_npc(npc: NPC) -> int:
+    with get_db_connection() as connection:
+        # Insert NPC into the database
+        cursor = connection.cursor()
+        with span("db_insert"):
             cursor.execute(
                 """
                 INSERT INTO npcs (name, personality, goals, assets, memory, background, appearance)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
                 """,
                 (
                     npc.name,
@@ -122,8 +147,21 @@ async def create_npc(npc: NPC):
                     npc.appearance,
                 ),
             )
+            (npc_id,) = cursor.fetchone()
+            record_changes(cursor, "create", [npc_id])
             connection.commit()
-        return {"message": "NPC created successfully!"}
+    return npc_id
+
+
+async def _create_npc(npc: NPC):
+    try:
+        # psycopg2 blocks, so database work runs off the event loop
+        npc_id = await run_in_threadpool(_insert_npc, npc)
+        feed.notify()
+        await run_in_threadpool(schedule_pregeneration, npc_id)
+        return {"message": "NPC created successfully!", "id": npc_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating NPC: {str(e)}")
 
@@ -131,105 +169,100 @@ async def create_npc(npc: NPC):
 @app.post("/npc/interact/{npc_id}")
 async def interact_with_npc(
     npc_id: int,
+    request: Request,
+    response: Response,
     player_input: str = Body(..., embed=True),
-    prompt_context: str = Body(..., embed=True),
+    prompt_context: Optional[str] = Body(None, embed=True),
+    x_player_id: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    try:
-        with get_db_connection() as connection:
-            # Fetch NPC from the database
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM npcs WHERE id = %s", (npc_id,))
-            npc = cursor.fetchone()
-            if not npc:
-                raise HTTPException(status_code=404, detail="NPC not found")
-
-            # Use the prompt_context to construct the prompt
-            messages = [
-                {
-                    "role": "system",
-                    "content": prompt_context,
-                },
-                {"role": "user", "content": player_input},
-            ]
-            response = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=150,
-            )
-            npc_response = (
-                response.choices[0].message.content.strip()
-                if response.choices[0].message.content
-                else ""
-            )
-
-            # Insert interaction into the database
-            cursor.execute(
-                """
-                INSERT INTO interactions (npc_id, player_input, npc_response)
-                VALUES (%s, %s, %s)
-                """,
-                (npc_id, player_input, npc_response),
-            )
-            connection.commit()
-        return {"npc_response": npc_response}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error during interaction: {str(e)}"
-        )
+    # Fall back to the client address when the caller doesn't identify the player
+    client = client_address(request)
+    player_id = x_player_id or client
+    return await idempotent(
+        response,
+        "interact",
+        idempotency_key,
+        [npc_id, player_id, player_input, prompt_context],
+        lambda: interact(client, npc_id, player_id, player_input, prompt_context),
+    )
 
 
 @app.get("/npc/list")
-async def list_npcs():
+def list_npcs(request: Request):
+    """All NPCs, plus the change-log `version` to follow /npc/changes from."""
     try:
         with get_db_connection() as connection:
             # Fetch all NPCs from the database
             cursor = connection.cursor()
-            cursor.execute("SELECT * FROM npcs")
-            npcs = cursor.fetchall()
-
-        # Convert tuples to dictionaries
-        npc_list = [
-            {
-                "id": npc[0],
-                "name": npc[1],
-                "background": npc[2],
-                "appearance": npc[3],
-                "personality": npc[4],
-                "goals": npc[5],
-                "assets": npc[6],
-                "memory": npc[7],
-            }
-            for npc in npcs
-        ]
-        return {"npcs": npc_list}
+            with span("db_select"):
+                version = head_version(cursor)
+                cursor.execute(f"SELECT {', '.join(NPC_COLUMNS)} FROM npcs")
+                npcs = cursor.fetchall()
+
+        with span("serialize"):
+            return rows_response(request, "npcs", NPC_COLUMNS, npcs, version=version)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching NPCs: {str(e)}")
 
 
-@app.delete("/npc/remove_empty_personality")
-async def remove_empty_personality_npcs():
-    try:
-        with get_db_connection() as connection:
-            # Delete NPCs with empty personality from the database
-            cursor = connection.cursor()
+@job("remove_empty_personality")
+def remove_empty_personality_job(ctx: JobContext):
+    """Delete NPCs with an empty personality in chunks, committing after each one."""
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM npcs WHERE personality IS NULL OR personality = ''"
+        )
+        (total,) = cursor.fetchone()
+    done = 0
+    ctx.progress(done, total)
+    while True:
+        with get_db_cursor(commit=True) as cursor:
             cursor.execute(
-                "DELETE FROM npcs WHERE personality IS NULL OR personality = ''"
+                """
+                DELETE FROM npcs WHERE id IN (
+                    SELECT id FROM npcs WHERE personality IS NULL OR personality = ''
+                    LIMIT %s
+                )
+                RETURNING id
+                """,
+                (ctx.chunk_size,),
             )
-            connection.commit()
-        return {"message": "NPCs with empty personality removed successfully!"}
+            deleted_ids = [row[0] for row in cursor.fetchall()]
+            record_changes(cursor, "delete", deleted_ids)
+            deleted = len(deleted_ids)
+        done += deleted
+        ctx.progress(done, total)
+        if deleted < ctx.chunk_size:
+            break
+
+
+@app.delete("/npc/remove_empty_personality", status_code=202)
+def remove_empty_personality_npcs():
+    try:
+        # Runs in the background; poll /jobs/{job_id} for progress
+        job_id = submit_job("remove_empty_personality")
+        return {
+            "message": "Removal of NPCs with empty personality started",
+            "job_id": job_id,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error removing NPCs: {str(e)}")
 
 
-@app.put("/npc/update/{npc_id}")
-async def update_npc(npc_id: int, npc: NPC):
-    try:
-        with get_db_connection() as connection:
-            # Update NPC in the database
-            cursor = connection.cursor()
+def _update_npc_row(npc_id: int, npc: NPC):
+    with get_db_connection() as connection:
+        # Update NPC in the database
+        cursor = connection.cursor()
+        with span("db_update"):
             cursor.execute(
                 """
-                UPDATE npcs SET name = %s, personality = %s, goals = %s, assets = %s, memory = %s, background = %s, appearance = %s
+                UPDATE npcs SET name = %s, personality = %s, goals = %s, assets = %s, memory = %s, background = %s, appearance = %s,
+                    persona_version = persona_version + 1
                 WHERE id = %s
                 """,
                 (
@@ -243,35 +276,44 @@ async def update_npc(npc_id: int, npc: NPC):
                     npc_id,
                 ),
             )
+            if cursor.rowcount:
+                record_changes(cursor, "update", [npc_id])
             connection.commit()
+
+
+@app.put("/npc/update/{npc_id}")
+async def update_npc(npc_id: int, npc: NPC):
+    try:
+        await run_in_threadpool(_update_npc_row, npc_id, npc)
+        feed.notify()
+        # Recompile the persona prefix on next use; other workers drop their
+        # sessions when the change feed reports the update
+        invalidate_persona(npc_id)
+        sessions.store.invalidate_npc(npc_id)
+        await run_in_threadpool(schedule_pregeneration, npc_id)
         return {"message": "NPC updated successfully!"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating NPC: {str(e)}")
 
 
 @app.get("/npc/interactions/{npc_id}")
-async def get_latest_interactions(npc_id: int, limit: int = 5):
+def get_latest_interactions(request: Request, npc_id: int, limit: int = 5):
     try:
         with get_db_connection() as connection:
             # Fetch latest interactions from the database
             cursor = connection.cursor()
-            cursor.execute(
-                """
-                SELECT player_input, npc_response FROM interactions
-                WHERE npc_id = %s
-                ORDER BY id DESC
-                LIMIT %s
-                """,
-                (npc_id, limit),
+            with span("db_select"):
+                execute_prepared(cursor, "latest_interactions", (npc_id, limit))
+                interactions = cursor.fetchall()
+
+        with span("serialize"):
+            return rows_response(
+                request, "interactions", ("player_input", "npc_response"), interactions
             )
-            interactions = cursor.fetchall()
-
-        # Convert tuples to dictionaries
-        interaction_list = [
-            {"player_input": interaction[0], "npc_response": interaction[1]}
-            for interaction in interactions
-        ]
-        return {"interactions": interaction_list}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching interactions: {str(e)}"
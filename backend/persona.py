@@ -0,0 +1,83 @@
+import json
+import os
+
+# Column order of `SELECT * FROM npcs`
+NPC_COLUMNS = (
+    "id",
+    "name",
+    "background",
+    "appearance",
+    "personality",
+    "goals",
+    "assets",
+    "memory",
+    "persona_version",
+)
+
+# Fields that make up the persona, in the order they are rendered
+PERSONA_FIELDS = (
+    "name",
+    "background",
+    "appearance",
+    "personality",
+    "goals",
+    "assets",
+    "memory",
+)
+
+# Number of past turns included as conversation context
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "10"))
+
+# Compiled system prefixes: npc_id -> (persona_version, prefix)
+_compiled = {}
+
+
+def npc_from_row(row) -> dict:
+    return dict(zip(NPC_COLUMNS, row))
+
+
+def render_persona(npc: dict) -> str:
+    """
+    System prompt describing an NPC.
+
+    Only persona fields go in, in a fixed order, so the rendered text is
+    byte-identical for a given persona_version and providers can cache it
+    as a prompt prefix.
+    """
+    persona = {field: npc[field] for field in PERSONA_FIELDS}
+    return (
+        f"You are {npc['name']}, a character in a game. Your details are:\n"
+        f"{json.dumps(persona, indent=1, ensure_ascii=False)}\n"
+        "Respond with a short, sweet reply to the player's input in the context "
+        "of your character and the conversation so far. Answer as if you were "
+        "speaking directly, without narrating any actions or emotions."
+    )
+
+
+def compile_persona(npc: dict) -> tuple:
+    """Return (persona_version, prefix), rendering only when the version changed."""
+    version = npc["persona_version"]
+    cached = _compiled.get(npc["id"])
+    if cached is None or cached[0] != version:
+        cached = _compiled[npc["id"]] = (version, render_persona(npc))
+    return cached
+
+
+def invalidate(npc_id: int):
+    _compiled.pop(npc_id, None)
+
+
+def build_messages(prefix: str, turns, player_input: str, context: str = None):
+    """
+    Chat messages with the stable prefix first and volatile content last:
+    persona, then past (player_input, npc_response) turns, then any extra
+    per-request context, then the new input.
+    """
+    messages = [{"role": "system", "content": prefix}]
+    for turn_input, turn_response in turns:
+        messages.append({"role": "user", "content": turn_input})
+        messages.append({"role": "assistant", "content": turn_response})
+    if context:
+        messages.append({"role": "system", "content": context})
+    messages.append({"role": "user", "content": player_input})
+    return messages
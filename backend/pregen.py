@@ -0,0 +1,212 @@
+"""
+Pre-generate greetings, barks and idle lines for NPCs.
+
+Runs as the `pregenerate_lines` background job or from the command line:
+
+    python backend/pregen.py [--npc-id ID ...] [--concurrency N] [--force]
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from fastapi import APIRouter, HTTPException
+from psycopg2.extras import execute_values
+
+import llm
+from admission import admission
+from db import execute_prepared, get_db_cursor
+from jobs import JobContext, job
+from persona import NPC_COLUMNS, compile_persona, npc_from_row
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+LINE_KINDS = ("greeting", "bark", "idle")
+LINES_PER_KIND = int(os.getenv("PREGEN_LINES_PER_KIND", "3"))
+PREGEN_CONCURRENCY = int(os.getenv("PREGEN_CONCURRENCY", "4"))
+
+INSTRUCTIONS = (
+    "Write lines this character might say unprompted. Reply with a JSON object "
+    'with the keys "greeting" (first words to a player who approaches), "bark" '
+    '(short reactions or calls) and "idle" (things muttered to themselves), '
+    f"each a list of {LINES_PER_KIND} distinct one-sentence lines."
+)
+
+
+def generate_lines(npc: dict) -> dict:
+    """One completion per NPC, reusing its cached persona prefix."""
+    _, prefix = compile_persona(npc)
+    # Every pre-generation run shares the background LLM budget
+    with admission.background_slot():
+        response = llm.complete_sync(
+            [
+                {"role": "system", "content": prefix},
+                {"role": "user", "content": INSTRUCTIONS},
+            ],
+            max_tokens=600,
+            response_format={"type": "json_object"},
+        )
+    data = json.loads(response.choices[0].message.content or "{}")
+    lines = {}
+    for kind in LINE_KINDS:
+        values = data.get(kind) or []
+        if isinstance(values, str):
+            values = [values]
+        lines[kind] = [str(v).strip() for v in values if str(v).strip()]
+        lines[kind] = lines[kind][:LINES_PER_KIND]
+    return lines
+
+
+def store_lines(npc: dict, lines: dict) -> bool:
+    """
+    Replace an NPC's lines with those generated for `npc["persona_version"]`.
+    Skipped (returning False) if the persona has moved on since, so a slow job
+    can't overwrite lines for a newer version.
+    """
+    with get_db_cursor(commit=True) as cursor:
+        # Row lock: concurrent jobs for one NPC write their lines in turn
+        cursor.execute(
+            "SELECT persona_version FROM npcs WHERE id = %s FOR UPDATE", (npc["id"],)
+        )
+        row = cursor.fetchone()
+        if not row or row[0] > npc["persona_version"]:
+            return False
+        cursor.execute(
+            "DELETE FROM npc_lines WHERE npc_id = %s AND persona_version <= %s",
+            (npc["id"], npc["persona_version"]),
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO npc_lines (npc_id, persona_version, kind, line) VALUES %s",
+            [
+                (npc["id"], npc["persona_version"], kind, line)
+                for kind, kind_lines in lines.items()
+                for line in kind_lines
+            ],
+        )
+    return True
+
+
+def npcs_to_generate(npc_ids=None, force=False) -> list:
+    """NPCs (optionally limited to `npc_ids`) lacking lines for their current persona."""
+    query = f"SELECT {', '.join(NPC_COLUMNS)} FROM npcs n WHERE TRUE"
+    params = []
+    if npc_ids:
+        query += " AND n.id = ANY(%s)"
+        params.append(list(npc_ids))
+    if not force:
+        query += """
+            AND NOT EXISTS (
+                SELECT 1 FROM npc_lines l
+                WHERE l.npc_id = n.id AND l.persona_version = n.persona_version
+            )
+        """
+    with get_db_cursor() as cursor:
+        cursor.execute(query + " ORDER BY n.id", params)
+        return [npc_from_row(row) for row in cursor.fetchall()]
+
+
+def pregenerate(
+    npc_ids=None, concurrency=PREGEN_CONCURRENCY, force=False, progress=None
+):
+    """
+    Generate and store lines with at most `concurrency` LLM calls in flight,
+    fewer if other runs hold the LLM_BACKGROUND_CONCURRENCY slots.
+    """
+    npcs = npcs_to_generate(npc_ids, force)
+    done = failed = 0
+    if progress:
+        progress(done, len(npcs))
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {executor.submit(generate_lines, npc): npc for npc in npcs}
+        for future in as_completed(futures):
+            npc = futures[future]
+            try:
+                if not store_lines(npc, future.result()):
+                    logger.info("Persona of NPC %s changed; lines discarded", npc["id"])
+            except Exception as e:
+                failed += 1
+                logger.warning("Pre-generation failed for NPC %s: %s", npc["id"], e)
+            done += 1
+            if progress:
+                progress(done, len(npcs))
+    finally:
+        # On cancellation, drop NPCs that haven't started yet
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if npcs and failed == len(npcs):
+        raise RuntimeError("Pre-generation failed for every NPC")
+    return done - failed
+
+
+@job("pregenerate_lines")
+def pregenerate_job(ctx: JobContext):
+    pregenerate(
+        npc_ids=ctx.params.get("npc_ids"),
+        concurrency=int(ctx.params.get("concurrency") or PREGEN_CONCURRENCY),
+        force=bool(ctx.params.get("force")),
+        progress=ctx.progress,
+    )
+
+
+def pregenerated_line(cursor, npc: dict, kind: str = "greeting"):
+    """A random stored line for the NPC's current persona, or None."""
+    execute_prepared(
+        cursor,
+        "pregenerated_line",
+        (npc["id"], npc["persona_version"], kind),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@router.get("/npc/lines/{npc_id}")
+def get_npc_lines(npc_id: int, kind: str = None):
+    if kind is not None and kind not in LINE_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {LINE_KINDS}")
+    with span("db_select"), get_db_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT l.kind, l.line FROM npc_lines l
+            JOIN npcs n ON n.id = l.npc_id AND n.persona_version = l.persona_version
+            WHERE l.npc_id = %s AND (%s IS NULL OR l.kind = %s)
+            ORDER BY l.kind, l.id
+            """,
+            (npc_id, kind, kind),
+        )
+        rows = cursor.fetchall()
+    lines = {k: [] for k in LINE_KINDS if kind in (None, k)}
+    for row_kind, line in rows:
+        lines[row_kind].append(line)
+    return {"lines": lines}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--npc-id", type=int, action="append", dest="npc_ids")
+    parser.add_argument("--concurrency", type=int, default=PREGEN_CONCURRENCY)
+    parser.add_argument(
+        "--force", action="store_true", help="regenerate lines that are up to date"
+    )
+    args = parser.parse_args()
+
+    generated = pregenerate(
+        args.npc_ids,
+        args.concurrency,
+        args.force,
+        progress=lambda done, total: logger.info("%s/%s NPCs", done, total),
+    )
+    logger.info("Generated lines for %s NPCs", generated)
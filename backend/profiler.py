@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter(prefix="/debug")
+
+# Off unless explicitly enabled; sampling costs CPU on a live worker
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+MAX_SECONDS = 60
+
+_running = threading.Lock()
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Sample every thread's stack, counting identical stacks in collapsed form."""
+    me = threading.get_ident()
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = 10, interval_ms: float = 10):
+    """
+    Sample this worker for `seconds` and return collapsed stacks
+    ("frame;frame;frame count" per line), ready for flamegraph.pl or speedscope.
+    """
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not 0 < seconds <= MAX_SECONDS:
+        raise HTTPException(
+            status_code=400, detail=f"seconds must be in (0, {MAX_SECONDS}]"
+        )
+    if not _running.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        # Sample from a worker thread so the event loop keeps serving (and shows up)
+        counts = await run_in_threadpool(
+            sample_stacks, seconds, max(interval_ms, 1) / 1000
+        )
+    finally:
+        _running.release()
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
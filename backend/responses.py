@@ -0,0 +1,63 @@
+import gzip
+import os
+
+import orjson
+from fastapi import Request, Response
+
+# Optional: brotli for `br` encoding, msgpack for `application/msgpack` clients
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _accepted_encodings(header: str) -> set:
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def fast_response(request: Request, content, status_code: int = 200) -> Response:
+    """
+    Serialize `content` with orjson (or msgpack when the client asks for it)
+    and compress it with brotli or gzip when large enough and accepted.
+    """
+    accept = request.headers.get("accept", "")
+    if msgpack is not None and any(t in accept for t in MSGPACK_TYPES):
+        body = msgpack.packb(content, default=str)
+        media_type = "application/msgpack"
+    else:
+        body = orjson.dumps(content)
+        media_type = "application/json"
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encodings = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        if brotli is not None and "br" in encodings:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in encodings:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return Response(body, status_code, headers=headers, media_type=media_type)
+
+
+def rows_response(request: Request, key: str, columns, rows, **extra) -> Response:
+    """Respond with `{key: [row, ...], **extra}`, each row keyed by `columns`, straight from cursor tuples."""
+    return fast_response(
+        request, {key: [dict(zip(columns, row)) for row in rows], **extra}
+    )
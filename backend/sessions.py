@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+import llm
+from admission import admission, client_address
+from changes import feed
+from db import execute_prepared, get_db_cursor
+from interactions import load_history, resolve_thread, save_interaction
+from persona import HISTORY_WINDOW, build_messages, compile_persona, npc_from_row
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class Session:
+    """Server-held conversation state for one player's thread with one NPC."""
+
+    def __init__(self, thread: dict, persona: tuple, turns, window: int):
+        self.npc_id = thread["npc_id"]
+        self.player_id = thread["player_id"]
+        self.thread_id = thread["id"]
+        self.persona_version, self.prefix = persona
+        self.turns = deque(turns, maxlen=window)
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+    def messages(self, player_input: str) -> list:
+        return build_messages(self.prefix, self.turns, player_input)
+
+
+def load_session(
+    player_id: str, npc_id: int, thread_id: Optional[int], window: int
+) -> Optional[Session]:
+    """
+    Read the NPC persona and the thread's recent history. Without a thread_id
+    the player's latest thread with the NPC is resumed, or a new one started.
+    None if the NPC or thread doesn't exist or belongs to someone else.
+    """
+    with get_db_cursor(commit=True) as cursor:
+        execute_prepared(cursor, "select_npc", (npc_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        thread = resolve_thread(cursor, npc_id, player_id, thread_id)
+        if not thread:
+            return None
+        turns = load_history(cursor, thread["id"], window)
+    persona = compile_persona(npc_from_row(row))
+    return Session(thread, persona, reversed(turns), window)
+
+
+def save_turn(session: Session, player_input: str, npc_response: str, usage: dict):
+    with get_db_cursor(commit=True) as cursor:
+        save_interaction(
+            cursor,
+            session.npc_id,
+            player_input,
+            npc_response,
+            session.persona_version,
+            usage,
+            session.player_id,
+            session.thread_id,
+        )
+
+
+class SessionStore:
+    """Live sessions keyed by (player, npc, thread), evicted after `idle_seconds` idle."""
+
+    def __init__(self, idle_seconds: float, max_sessions: int, window: int):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.window = window
+        self._sessions: OrderedDict = OrderedDict()
+        self._writes = set()
+
+    async def get(
+        self, player_id: str, npc_id: int, thread_id: int = None
+    ) -> Optional[Session]:
+        """
+        The session of a thread, loaded unless live. Without a thread_id the
+        player's latest thread is looked up afresh; pass the returned
+        session's thread_id afterwards to stay in that thread.
+        """
+        session = self._sessions.get((player_id, npc_id, thread_id))
+        if session is None:
+            loaded = await run_in_threadpool(
+                load_session, player_id, npc_id, thread_id, self.window
+            )
+            if loaded is None:
+                return None
+            # Sessions are keyed by resolved thread; keep one that is already live
+            session = self._sessions.setdefault(
+                (player_id, npc_id, loaded.thread_id), loaded
+            )
+        self._sessions.move_to_end((player_id, npc_id, session.thread_id))
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        session.last_active = time.monotonic()
+        return session
+
+    def persist(self, session: Session, player_input: str, npc_response: str, usage):
+        """Write a turn in the background so the reply isn't held up by the insert."""
+        task = asyncio.create_task(
+            run_in_threadpool(save_turn, session, player_input, npc_response, usage)
+        )
+        self._writes.add(task)
+        task.add_done_callback(self._write_done)
+
+    def _write_done(self, task: asyncio.Task):
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Failed to persist session turn: %s", task.exception())
+
+    def invalidate_npc(self, npc_id: int):
+        """Drop sessions of an NPC whose persona changed; they reload on next use."""
+        for key in [key for key in self._sessions if key[1] == npc_id]:
+            del self._sessions[key]
+
+    async def follow_changes(self, retry_seconds: float = 5):
+        """
+        Drop sessions of NPCs changed on any worker, as the change feed
+        reports them, so no session keeps a stale persona prefix.
+        """
+        while True:
+            try:
+                queue = await feed.subscribe()
+            except Exception as e:
+                logger.warning("Could not subscribe to the change feed: %s", e)
+                await asyncio.sleep(retry_seconds)
+                continue
+            try:
+                while (changes := await queue.get()) is not None:
+                    for npc_id in {change["npc_id"] for change in changes}:
+                        self.invalidate_npc(npc_id)
+            finally:
+                feed.unsubscribe(queue)
+            # Fell behind the feed and may have missed changes
+            self._sessions.clear()
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # Sessions are kept in least-recently-active order
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.last_active > cutoff:
+                break
+            del self._sessions[key]
+
+    async def sweep(self, interval: float = 30):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    async def drain(self):
+        """Wait for pending turn writes, e.g. on shutdown."""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+async def receive_player_input(websocket: WebSocket) -> str:
+    """Read the next `{"player_input": "..."}` frame; 400 if it isn't one."""
+    try:
+        data = await websocket.receive_json()
+    except (ValueError, KeyError):
+        # Not JSON, or a binary frame
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("player_input"), str):
+        raise HTTPException(
+            status_code=400, detail='Expected a {"player_input": "..."} frame'
+        )
+    return data["player_input"]
+
+
+store = SessionStore(
+    idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", "600")),
+    max_sessions=int(os.getenv("SESSION_MAX", "5000")),
+    window=HISTORY_WINDOW,
+)
+
+
+@router.websocket("/npc/session/{npc_id}")
+async def npc_session(
+    websocket: WebSocket, npc_id: int, player_id: str = None, thread_id: int = None
+):
+    """
+    Chat with an NPC over one connection, in `thread_id` or the player's
+    latest thread with the NPC.
+
+    The first frame is `{"thread_id": N}`. Send `{"player_input": "..."}`; the
+    reply streams back as `{"delta": "..."}` frames followed by
+    `{"npc_response": "...", "done": true}`. Errors arrive as
+    `{"error": "...", "status": 400|429|503|500}` and leave the session open.
+    """
+    await websocket.accept()
+    client = client_address(websocket)
+    player_id = player_id or client
+    try:
+        session = await store.get(player_id, npc_id, thread_id)
+    except HTTPException as e:
+        await websocket.close(code=1013, reason=e.detail)
+        return
+    if session is None:
+        await websocket.close(code=4404, reason="NPC or thread not found")
+        return
+
+    # Stay in this thread even if the player starts another one meanwhile
+    thread_id = session.thread_id
+
+    try:
+        await websocket.send_json({"thread_id": thread_id})
+        while True:
+            try:
+                player_input = await receive_player_input(websocket)
+                # Reloads the context if the session was evicted meanwhile
+                session = await store.get(player_id, npc_id, thread_id) or session
+                admission.check_rate(client, player_id, npc_id)
+                async with session.lock, admission.llm_slot(client, player_id):
+                    parts = []
+                    usage = {}
+                    messages = session.messages(player_input)
+                    async for delta in llm.stream(messages, usage=usage):
+                        parts.append(delta)
+                        await websocket.send_json({"delta": delta})
+                    npc_response = "".join(parts).strip()
+                    session.turns.append((player_input, npc_response))
+            except HTTPException as e:
+                await websocket.send_json(
+                    {
+                        "error": e.detail,
+                        "status": e.status_code,
+                        "retry_after": (e.headers or {}).get("Retry-After"),
+                    }
+                )
+                continue
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.exception("Session turn failed")
+                await websocket.send_json({"error": str(e), "status": 500})
+                continue
+            await websocket.send_json({"npc_response": npc_response, "done": True})
+            store.persist(session, player_input, npc_response, usage)
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,281 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from starlette.requests import Request
+
+import admission
+from admission import (
+    AdmissionController,
+    FairQueue,
+    QueueFull,
+    RateLimiter,
+    TokenBucket,
+    client_address,
+)
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_reports_wait(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.take()
+    bucket.take()
+    clock.now += 10
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+
+def test_rate_limiter_keeps_keys_separate(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.take("a") == 0
+    assert limiter.take("a") > 0
+    assert limiter.take("b") == 0
+
+
+def test_rate_limiter_prunes_only_idle_keys(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    limiter.take("idle")
+    clock.now += 5
+    limiter.take("busy")
+    limiter.take("new")
+    assert set(limiter._buckets) == {"busy", "new"}
+
+
+def test_check_rate_limits_client_across_player_ids(clock):
+    controller = AdmissionController(
+        client_rate=1,
+        client_burst=2,
+        player_rate=1,
+        player_burst=5,
+        npc_rate=1,
+        npc_burst=5,
+        max_active=1,
+        max_queued=1,
+    )
+    controller.check_rate("10.0.0.1", "p1", 1)
+    controller.check_rate("10.0.0.1", "p2", 1)
+    with pytest.raises(HTTPException) as excinfo:
+        controller.check_rate("10.0.0.1", "p3", 1)
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers["Retry-After"] == "1"
+    controller.check_rate("10.0.0.2", "p3", 1)
+
+
+def test_client_limit_is_off_by_default(clock):
+    controller = AdmissionController(
+        player_rate=1,
+        player_burst=1,
+        npc_rate=1,
+        npc_burst=100,
+        max_active=1,
+        max_queued=1,
+    )
+    for player in range(20):
+        controller.check_rate("10.0.0.1", f"p{player}", 1)
+    # Player buckets still apply, per (client, player)
+    with pytest.raises(HTTPException):
+        controller.check_rate("10.0.0.1", "p0", 1)
+    controller.check_rate("10.0.0.2", "p0", 1)
+
+
+def make_request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_client_address_ignores_forwarded_for_from_untrusted_peer(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", {"10.0.0.9"})
+    assert client_address(make_request("1.2.3.4", "5.6.7.8")) == "1.2.3.4"
+
+
+def test_client_address_takes_nearest_untrusted_hop(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", {"10.0.0.9", "10.0.0.8"})
+    request = make_request("10.0.0.9", "6.6.6.6, 5.6.7.8, 10.0.0.8")
+    assert client_address(request) == "5.6.7.8"
+
+
+def test_fair_queue_releases_round_robin_across_lanes():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=10)
+        await queue.acquire("holder")
+        order = []
+
+        async def wait(lane, name):
+            await queue.acquire(lane)
+            order.append(name)
+
+        tasks = [
+            asyncio.create_task(wait(lane, name))
+            for lane, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]
+        ]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            queue.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(main()) == ["a1", "b1", "a2", "a3"]
+
+
+def test_fair_queue_alternates_players_behind_one_client():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=10)
+        await queue.acquire("holder")
+        order = []
+
+        async def wait(player, name):
+            await queue.acquire("streamlit", player)
+            order.append(name)
+
+        tasks = [
+            asyncio.create_task(wait(player, name))
+            for player, name in [
+                ("alice", "a1"),
+                ("alice", "a2"),
+                ("alice", "a3"),
+                ("bob", "b1"),
+                ("bob", "b2"),
+            ]
+        ]
+        other = asyncio.create_task(wait_other(queue, order))
+        await asyncio.sleep(0)
+        for _ in range(6):
+            queue.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks, other)
+        return order
+
+    async def wait_other(queue, order):
+        await queue.acquire("game", "carol")
+        order.append("c1")
+
+    # Clients alternate first, then players within the shared client
+    assert run(main()) == ["a1", "c1", "b1", "a2", "b2", "a3"]
+
+
+def test_fair_queue_hands_slot_over_on_release():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=1)
+        await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        queue.release()
+        await waiter
+        # The slot moved to the waiter rather than being freed
+        assert queue._active == 1 and queue._queued == 0
+        queue.release()
+        assert queue._active == 0
+
+    run(main())
+
+
+def test_fair_queue_rejects_when_full():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=1)
+        await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await queue.acquire("c")
+        waiter.cancel()
+
+    run(main())
+
+
+def test_fair_queue_cancel_while_queued_frees_the_place():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=1)
+        await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queue._queued == 0 and not queue._waiters
+        queue.release()
+        assert queue._active == 0
+
+    run(main())
+
+
+def test_fair_queue_cancel_after_hand_off_releases_the_slot():
+    async def main():
+        queue = FairQueue(max_active=1, max_queued=1)
+        await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        queue.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queue._active == 0
+
+    run(main())
+
+
+def test_llm_slot_returns_503_when_queue_is_full():
+    async def main():
+        controller = AdmissionController(1, 1, 1, 1, max_active=1, max_queued=0)
+        async with controller.llm_slot("a"):
+            with pytest.raises(HTTPException) as excinfo:
+                async with controller.llm_slot("b"):
+                    pass
+        assert excinfo.value.status_code == 503
+        assert controller.queue._active == 0
+
+    run(main())
+
+
+def test_background_slots_cap_concurrent_holders():
+    controller = AdmissionController(
+        1, 1, 1, 1, max_active=1, max_queued=0, max_background=2
+    )
+    lock = threading.Lock()
+    running = peak = 0
+
+    def work():
+        nonlocal running, peak
+        with controller.background_slot():
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        for _ in range(6):
+            executor.submit(work)
+    assert peak == 2
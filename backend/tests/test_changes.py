@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import changes
+from changes import ChangeFeed
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def log(monkeypatch):
+    """An in-memory change log standing in for the npc_changes table."""
+    entries = []
+    monkeypatch.setattr(changes, "POLL_SECONDS", 0.01)
+    monkeypatch.setattr(
+        changes, "latest_version", lambda: entries[-1]["version"] if entries else 0
+    )
+    monkeypatch.setattr(
+        changes,
+        "fetch_changes",
+        lambda since, limit=changes.MAX_BATCH: [
+            e for e in entries if e["version"] > since
+        ][:limit],
+    )
+
+    def append(npc_id):
+        entries.append({"version": len(entries) + 1, "npc_id": npc_id})
+
+    return append
+
+
+def versions(batch):
+    return [change["version"] for change in batch]
+
+
+def test_feed_fans_new_changes_out_to_every_subscriber(log):
+    async def main():
+        feed = ChangeFeed()
+        log(1)
+        first = await feed.subscribe()
+        second = await feed.subscribe()
+        log(2)
+        feed.notify()
+        batches = [await asyncio.wait_for(queue.get(), 1) for queue in (first, second)]
+        # Only what came after subscribing
+        assert [versions(batch) for batch in batches] == [[2], [2]]
+        feed.unsubscribe(first)
+        feed.unsubscribe(second)
+
+    run(main())
+
+
+def test_feed_drops_a_subscriber_that_falls_behind(log):
+    async def main():
+        feed = ChangeFeed(max_pending=1)
+        slow = await feed.subscribe()
+        fast = await feed.subscribe()
+        for npc_id in (1, 2):
+            log(npc_id)
+            feed.notify()
+            assert versions(await asyncio.wait_for(fast.get(), 1)) == [npc_id]
+        # The backlog is replaced by None, telling it to resume with ?since=
+        assert await asyncio.wait_for(slow.get(), 1) is None
+        assert slow.empty()
+        assert feed._subscribers == {fast}
+        feed.unsubscribe(fast)
+
+    run(main())
@@ -0,0 +1,61 @@
+import pytest
+
+import db
+from db import PREPARED_STATEMENTS, execute_prepared
+from persona import NPC_COLUMNS
+
+
+class FakeCursor:
+    def __init__(self, fail_prepare=False):
+        self.connection = type("Connection", (), {"prepared": set()})()
+        self.fail_prepare = fail_prepare
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith("PREPARE") and self.fail_prepare:
+            raise RuntimeError('relation "threads" does not exist')
+        self.statements.append((sql.split(" AS ")[0], params))
+
+
+def test_statements_are_prepared_once_per_connection():
+    cursor = FakeCursor()
+    execute_prepared(cursor, "select_npc", (1,))
+    execute_prepared(cursor, "select_npc", (2,))
+    assert cursor.statements == [
+        ("PREPARE select_npc", None),
+        ("EXECUTE select_npc (%s)", (1,)),
+        ("EXECUTE select_npc (%s)", (2,)),
+    ]
+
+
+def test_failed_prepare_is_retried_on_next_use():
+    cursor = FakeCursor(fail_prepare=True)
+    with pytest.raises(RuntimeError):
+        execute_prepared(cursor, "select_thread", (1,))
+    assert cursor.connection.prepared == set()
+
+
+def test_select_npc_lists_columns_in_npc_order():
+    assert PREPARED_STATEMENTS["select_npc"].startswith(
+        f"SELECT {', '.join(NPC_COLUMNS)} FROM"
+    )
+
+
+def test_pool_creation_backs_off_after_failure(monkeypatch):
+    attempts = []
+
+    def refuse(*args, **kwargs):
+        attempts.append(kwargs)
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(db.pool, "ThreadedConnectionPool", refuse)
+    monkeypatch.setattr(db, "_connection_pool", None)
+    monkeypatch.setattr(db, "_retry_at", 0.0)
+    monkeypatch.setattr(db, "_retry_delay", 0.0)
+    with pytest.raises(ConnectionRefusedError):
+        db.get_pool()
+    # Within the back-off window callers fail fast without connecting
+    with pytest.raises(ConnectionError):
+        db.get_pool()
+    assert len(attempts) == 1
+    assert attempts[0]["connect_timeout"] == db.CONNECT_TIMEOUT
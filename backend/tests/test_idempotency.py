@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+
+import idempotency
+from idempotency import IdempotencyStore, idempotent
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Counter:
+    """Async callable that counts calls and can be held open or made to fail."""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.gate = None
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("boom")
+        return {"call": self.calls}
+
+
+def test_replay_returns_stored_result():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        fn = Counter()
+        first = await store.run("s", "k", "f", fn)
+        second = await store.run("s", "k", "f", fn)
+        return fn.calls, first, second
+
+    calls, first, second = run(main())
+    assert calls == 1
+    assert first == ({"call": 1}, False)
+    assert second == ({"call": 1}, True)
+
+
+def test_keys_are_scoped():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        fn = Counter()
+        await store.run("create", "k", "f", fn)
+        await store.run("interact", "k", "f", fn)
+        return fn.calls
+
+    assert run(main()) == 2
+
+
+def test_concurrent_duplicate_waits_for_original():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        fn = Counter()
+        fn.gate = asyncio.Event()
+        original = asyncio.create_task(store.run("s", "k", "f", fn))
+        duplicate = asyncio.create_task(store.run("s", "k", "f", fn))
+        await asyncio.sleep(0)
+        assert not duplicate.done()
+        fn.gate.set()
+        return fn.calls, await original, await duplicate
+
+    calls, original, duplicate = run(main())
+    assert calls == 1
+    assert original == ({"call": 1}, False)
+    assert duplicate == ({"call": 1}, True)
+
+
+def test_failure_releases_the_key():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        fn = Counter(fail=True)
+        with pytest.raises(RuntimeError):
+            await store.run("s", "k", "f", fn)
+        fn.fail = False
+        return await store.run("s", "k", "f", fn), fn.calls
+
+    assert run(main()) == (({"call": 2}, False), 2)
+
+
+def test_waiter_takes_over_when_original_fails():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        failing = Counter(fail=True)
+        failing.gate = asyncio.Event()
+        retry = Counter()
+        original = asyncio.create_task(store.run("s", "k", "f", failing))
+        duplicate = asyncio.create_task(store.run("s", "k", "f", retry))
+        await asyncio.sleep(0)
+        failing.gate.set()
+        with pytest.raises(RuntimeError):
+            await original
+        return await duplicate
+
+    assert run(main()) == ({"call": 1}, False)
+
+
+def test_different_request_under_same_key_is_rejected():
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        await store.run("s", "k", "f1", Counter())
+        await store.run("s", "k", "f2", Counter())
+
+    with pytest.raises(HTTPException) as excinfo:
+        run(main())
+    assert excinfo.value.status_code == 422
+
+
+def test_expired_keys_run_again(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(idempotency.time, "monotonic", lambda: now[0])
+
+    async def main():
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        fn = Counter()
+        await store.run("s", "k", "f", fn)
+        now[0] += 61
+        return await store.run("s", "k", "f", fn)
+
+    assert run(main()) == ({"call": 2}, False)
+
+
+def test_idempotent_flags_replays_and_passes_through_without_key():
+    async def main():
+        fn = Counter()
+        first, second, unkeyed = Response(), Response(), Response()
+        await idempotent(first, "test", "key", {"a": 1}, fn)
+        await idempotent(second, "test", "key", {"a": 1}, fn)
+        await idempotent(unkeyed, "test", None, {"a": 1}, fn)
+        return fn.calls, first, second, unkeyed
+
+    calls, first, second, unkeyed = run(main())
+    assert calls == 2
+    assert "Idempotent-Replayed" not in first.headers
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in unkeyed.headers
@@ -0,0 +1,58 @@
+from interactions import load_history, resolve_thread
+
+
+class FakeCursor:
+    """Answers each fetch with the next of `rows`, recording what was run."""
+
+    def __init__(self, *rows):
+        self.connection = type("Connection", (), {"prepared": set()})()
+        self.rows = list(rows)
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def fetchall(self):
+        return self.rows.pop(0)
+
+
+def thread_row(thread_id=7, npc_id=3, player_id="p1"):
+    return (thread_id, npc_id, player_id, None, None)
+
+
+def test_resolve_thread_returns_the_players_own_thread():
+    cursor = FakeCursor(thread_row())
+    assert resolve_thread(cursor, 3, "p1", 7)["id"] == 7
+
+
+def test_resolve_thread_hides_another_players_thread():
+    assert resolve_thread(FakeCursor(thread_row()), 3, "p2", 7) is None
+
+
+def test_resolve_thread_rejects_a_thread_with_another_npc():
+    assert resolve_thread(FakeCursor(thread_row()), 4, "p1", 7) is None
+
+
+def test_resolve_thread_rejects_a_missing_thread():
+    assert resolve_thread(FakeCursor(None), 3, "p1", 7) is None
+
+
+def test_resolve_thread_defaults_to_the_latest_thread():
+    cursor = FakeCursor(thread_row(thread_id=9))
+    assert resolve_thread(cursor, 3, "p1")["id"] == 9
+    assert not any(s.startswith("INSERT") for s in cursor.statements)
+
+
+def test_resolve_thread_starts_a_thread_when_there_is_none():
+    cursor = FakeCursor(None, thread_row(thread_id=12))
+    assert resolve_thread(cursor, 3, "p1")["id"] == 12
+    assert cursor.statements[-1].startswith("INSERT INTO threads")
+
+
+def test_load_history_reads_only_the_thread():
+    cursor = FakeCursor([("hi", "hello")])
+    assert load_history(cursor, 7, limit=4) == [("hi", "hello")]
+    assert cursor.statements[-1] == "EXECUTE thread_interactions (%s, %s)"
@@ -0,0 +1,83 @@
+import pytest
+from fastapi import HTTPException
+
+import jobs
+from jobs import JobCancelled, JobContext, job
+
+
+@pytest.fixture
+def statuses(monkeypatch):
+    """Record status writes instead of touching the jobs table."""
+    recorded = []
+    monkeypatch.setattr(
+        jobs, "_set_status", lambda job_id, status, error=None: recorded.append(status)
+    )
+    monkeypatch.setattr(JobContext, "progress", lambda self, done, total=None: None)
+    return recorded
+
+
+def run_job(kind, params=None, job_id=1):
+    jobs._live_jobs.add(job_id)
+    jobs._run(job_id, kind, params or {})
+    assert job_id not in jobs._live_jobs
+
+
+@job("test_ok")
+def ok_job(ctx):
+    ctx.progress(1, 1)
+
+
+@job("test_boom")
+def boom_job(ctx):
+    raise RuntimeError("boom")
+
+
+@job("test_cancelled")
+def cancelled_job(ctx):
+    raise JobCancelled()
+
+
+def test_successful_job_runs_then_succeeds(statuses):
+    run_job("test_ok")
+    assert statuses == ["running", "succeeded"]
+
+
+def test_failing_job_is_marked_failed(statuses, monkeypatch):
+    errors = []
+    monkeypatch.setattr(
+        jobs, "_set_status", lambda job_id, status, error=None: errors.append(error)
+    )
+    run_job("test_boom")
+    assert errors == [None, "boom"]
+
+
+def test_cancel_seen_by_the_handler(statuses):
+    run_job("test_cancelled")
+    assert statuses == ["running", "cancelled"]
+
+
+def test_cancel_while_queued_never_runs(statuses, monkeypatch):
+    def cancelled(self, done, total=None):
+        raise JobCancelled()
+
+    monkeypatch.setattr(JobContext, "progress", cancelled)
+    run_job("test_ok")
+    assert statuses == ["cancelled"]
+
+
+def test_bad_params_fail_the_job_and_release_it(statuses):
+    run_job("test_ok", {"chunk_size": "abc"})
+    assert statuses == ["failed"]
+
+
+@pytest.mark.parametrize("chunk_size", ["abc", 0, -5, 1.5, True])
+def test_submit_rejects_bad_chunk_size(chunk_size):
+    with pytest.raises(HTTPException) as excinfo:
+        jobs.submit_job("test_ok", {"chunk_size": chunk_size})
+    assert excinfo.value.status_code == 400
+
+
+def test_submit_rejects_unknown_kind():
+    with pytest.raises(HTTPException) as excinfo:
+        jobs.submit_job("no_such_job")
+    assert excinfo.value.status_code == 400
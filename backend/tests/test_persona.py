@@ -0,0 +1,58 @@
+from persona import (
+    NPC_COLUMNS,
+    build_messages,
+    compile_persona,
+    invalidate,
+    npc_from_row,
+)
+
+
+def make_npc(**fields):
+    npc = dict.fromkeys(NPC_COLUMNS, "")
+    npc.update(id=1, name="Mara", persona_version=1)
+    npc.update(fields)
+    return npc
+
+
+def test_build_messages_orders_stable_prefix_first():
+    messages = build_messages(
+        "PERSONA", [("hi", "hello"), ("bye", "farewell")], "again?", context="CTX"
+    )
+    assert messages == [
+        {"role": "system", "content": "PERSONA"},
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": "bye"},
+        {"role": "assistant", "content": "farewell"},
+        {"role": "system", "content": "CTX"},
+        {"role": "user", "content": "again?"},
+    ]
+
+
+def test_build_messages_without_history_or_context():
+    assert build_messages("PERSONA", [], "hi") == [
+        {"role": "system", "content": "PERSONA"},
+        {"role": "user", "content": "hi"},
+    ]
+
+
+def test_npc_from_row_follows_column_order():
+    row = tuple(range(len(NPC_COLUMNS)))
+    assert npc_from_row(row) == dict(zip(NPC_COLUMNS, row))
+
+
+def test_compile_persona_is_cached_per_version():
+    invalidate(1)
+    version, prefix = compile_persona(make_npc(goals="treasure"))
+    assert version == 1 and "treasure" in prefix
+    # Same version: the cached prefix is reused even if fields differ
+    assert compile_persona(make_npc(goals="revenge")) == (1, prefix)
+    version, prefix = compile_persona(make_npc(goals="revenge", persona_version=2))
+    assert version == 2 and "revenge" in prefix
+
+
+def test_compiled_prefix_ignores_non_persona_fields():
+    invalidate(1)
+    first = compile_persona(make_npc())
+    invalidate(1)
+    assert compile_persona(make_npc(id=1, extra="ignored")) == first
@@ -0,0 +1,48 @@
+import gzip
+
+import orjson
+from starlette.requests import Request
+
+import responses
+from responses import _accepted_encodings, fast_response, rows_response
+
+
+def make_request(**headers):
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        }
+    )
+
+
+def test_accepted_encodings_parses_lists_and_case():
+    assert _accepted_encodings("gzip, BR;q=0.8, deflate") == {"gzip", "br", "deflate"}
+
+
+def test_accepted_encodings_skips_q_zero():
+    assert _accepted_encodings("gzip;q=0, br; q=0.0, identity") == {"identity"}
+
+
+def test_small_bodies_are_not_compressed():
+    response = fast_response(make_request(**{"Accept-Encoding": "gzip"}), {"a": 1})
+    assert "content-encoding" not in response.headers
+    assert orjson.loads(response.body) == {"a": 1}
+
+
+def test_large_bodies_are_gzipped_when_accepted(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    content = {"text": "x" * responses.COMPRESS_MIN_BYTES}
+    response = fast_response(make_request(**{"Accept-Encoding": "gzip"}), content)
+    assert response.headers["content-encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(response.body)) == content
+
+
+def test_rows_response_keys_rows_by_columns_and_adds_extra_fields():
+    response = rows_response(
+        make_request(), "npcs", ("id", "name"), [(1, "a"), (2, "b")], version=7
+    )
+    assert orjson.loads(response.body) == {
+        "npcs": [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}],
+        "version": 7,
+    }
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import sessions
+from sessions import Session, SessionStore, receive_player_input
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Stand-in for load_session: thread 11 is the latest, 404 for npc 404."""
+    calls = []
+
+    def load_session(player_id, npc_id, thread_id, window):
+        calls.append((player_id, npc_id, thread_id))
+        if npc_id == 404:
+            return None
+        thread = {"id": thread_id or 11, "npc_id": npc_id, "player_id": player_id}
+        return Session(thread, (1, "prefix"), [], window)
+
+    monkeypatch.setattr(sessions, "load_session", load_session)
+    return calls
+
+
+def make_store(**kwargs):
+    return SessionStore(
+        **{"idle_seconds": 60, "max_sessions": 10, "window": 4, **kwargs}
+    )
+
+
+def test_sessions_are_keyed_by_resolved_thread(loads):
+    async def main():
+        store = make_store()
+        latest = await store.get("p1", 3)
+        assert latest.thread_id == 11
+        # Pinning the resolved thread reuses the live session
+        assert await store.get("p1", 3, 11) is latest
+        assert loads == [("p1", 3, None)]
+        assert list(store._sessions) == [("p1", 3, 11)]
+
+    run(main())
+
+
+def test_loading_an_already_live_thread_keeps_the_live_session(loads):
+    async def main():
+        store = make_store()
+        pinned = await store.get("p1", 3, 11)
+        assert await store.get("p1", 3) is pinned
+        assert len(store._sessions) == 1
+
+    run(main())
+
+
+def test_missing_npc_or_thread_gives_no_session(loads):
+    async def main():
+        store = make_store()
+        assert await store.get("p1", 404) is None
+        assert not store._sessions
+
+    run(main())
+
+
+def test_invalidate_npc_drops_only_that_npcs_sessions(loads):
+    async def main():
+        store = make_store()
+        await store.get("p1", 3)
+        await store.get("p2", 3, 12)
+        await store.get("p1", 4)
+        store.invalidate_npc(3)
+        assert list(store._sessions) == [("p1", 4, 11)]
+
+    run(main())
+
+
+def test_store_keeps_at_most_max_sessions(loads):
+    async def main():
+        store = make_store(max_sessions=2)
+        for npc_id in (1, 2, 3):
+            await store.get("p1", npc_id)
+        assert [key[1] for key in store._sessions] == [2, 3]
+
+    run(main())
+
+
+def test_evict_idle_drops_sessions_idle_too_long(loads, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: now[0])
+
+    async def main():
+        store = make_store(idle_seconds=60)
+        await store.get("p1", 1)
+        now[0] += 50
+        await store.get("p1", 2)
+        now[0] += 20
+        store.evict_idle()
+        assert [key[1] for key in store._sessions] == [2]
+
+    run(main())
+
+
+class FakeWebSocket:
+    def __init__(self, frame):
+        self.frame = frame
+
+    async def receive_json(self):
+        if isinstance(self.frame, Exception):
+            raise self.frame
+        return self.frame
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        ValueError("not JSON"),
+        KeyError("text"),
+        [1],
+        {"text": "hi"},
+        {"player_input": 5},
+    ],
+)
+def test_receive_player_input_rejects_other_frames(frame):
+    with pytest.raises(HTTPException) as excinfo:
+        run(receive_player_input(FakeWebSocket(frame)))
+    assert excinfo.value.status_code == 400
+
+
+def test_receive_player_input_returns_the_input():
+    assert run(receive_player_input(FakeWebSocket({"player_input": "hi"}))) == "hi"
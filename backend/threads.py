@@ -0,0 +1,110 @@
+from typing import Optional
+
+from fastapi import APIRouter, Body, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from admission import client_address
+from db import execute_prepared, get_db_cursor
+from idempotency import idempotent
+from interactions import THREAD_COLUMNS, create_thread, get_thread, interact
+from responses import fast_response, rows_response
+from tracing import span
+
+router = APIRouter(prefix="/threads")
+
+
+def _thread_or_404(cursor, thread_id: int, player_id: str) -> dict:
+    """The thread if it belongs to `player_id`; another player's is a 404 too."""
+    thread = get_thread(cursor, thread_id)
+    if not thread or thread["player_id"] != player_id:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return thread
+
+
+def _lookup_thread(thread_id: int, player_id: str) -> dict:
+    with span("db_select"), get_db_cursor() as cursor:
+        return _thread_or_404(cursor, thread_id, player_id)
+
+
+# Every endpoint names the player in X-Player-Id, as /npc/interact does
+
+
+@router.post("")
+def start_thread(npc_id: int = Body(..., embed=True), x_player_id: str = Header(...)):
+    with span("db_insert"), get_db_cursor(commit=True) as cursor:
+        cursor.execute("SELECT 1 FROM npcs WHERE id = %s", (npc_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="NPC not found")
+        return create_thread(cursor, npc_id, x_player_id)
+
+
+@router.get("")
+def list_threads(
+    request: Request,
+    x_player_id: str = Header(...),
+    npc_id: int = None,
+    limit: int = 20,
+):
+    with span("db_select"), get_db_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {', '.join(THREAD_COLUMNS)} FROM threads
+            WHERE player_id = %s AND (%s IS NULL OR npc_id = %s)
+            ORDER BY last_active_at DESC
+            LIMIT %s
+            """,
+            (x_player_id, npc_id, npc_id, limit),
+        )
+        threads = cursor.fetchall()
+    return rows_response(request, "threads", THREAD_COLUMNS, threads)
+
+
+@router.get("/{thread_id}/interactions")
+def get_thread_interactions(
+    request: Request, thread_id: int, x_player_id: str = Header(...), limit: int = 5
+):
+    with get_db_cursor() as cursor:
+        with span("db_select"):
+            _thread_or_404(cursor, thread_id, x_player_id)
+            execute_prepared(cursor, "thread_interactions", (thread_id, limit))
+            interactions = cursor.fetchall()
+    with span("serialize"):
+        return rows_response(
+            request, "interactions", ("player_input", "npc_response"), interactions
+        )
+
+
+@router.post("/{thread_id}/interact")
+async def interact_in_thread(
+    thread_id: int,
+    request: Request,
+    response: Response,
+    player_input: str = Body(..., embed=True),
+    prompt_context: Optional[str] = Body(None, embed=True),
+    x_player_id: str = Header(...),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """Like /npc/interact, in a thread of the player named by X-Player-Id."""
+    thread = await run_in_threadpool(_lookup_thread, thread_id, x_player_id)
+    return await idempotent(
+        response,
+        f"thread:{thread_id}",
+        idempotency_key,
+        [player_input, prompt_context],
+        lambda: interact(
+            client_address(request),
+            thread["npc_id"],
+            x_player_id,
+            player_input,
+            prompt_context,
+            thread_id=thread_id,
+        ),
+    )
+
+
+@router.get("/{thread_id}")
+def get_thread_details(
+    request: Request, thread_id: int, x_player_id: str = Header(...)
+):
+    thread = _lookup_thread(thread_id, x_player_id)
+    return fast_response(request, thread)
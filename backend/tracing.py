@@ -0,0 +1,57 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import orjson
+from fastapi import Request
+
+logger = logging.getLogger("npc.timing")
+
+# (name, duration_ms) pairs recorded during the current request
+_spans: ContextVar[Optional[list]] = ContextVar("spans", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current request. A no-op outside of a request."""
+    spans = _spans.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if spans is not None:
+            spans.append((name, (time.perf_counter() - start) * 1000))
+
+
+async def server_timing(request: Request, call_next):
+    """HTTP middleware: report spans in a Server-Timing header and a JSON log line."""
+    spans = []
+    token = _spans.set(spans)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _spans.reset(token)
+    total = (time.perf_counter() - start) * 1000
+
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{name};dur={duration:.1f}" for name, duration in spans]
+        + [f"total;dur={total:.1f}"]
+    )
+    logger.info(
+        orjson.dumps(
+            {
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": round(total, 1),
+                "spans": [
+                    {"name": name, "duration_ms": round(duration, 1)}
+                    for name, duration in spans
+                ],
+            }
+        ).decode()
+    )
+    return response
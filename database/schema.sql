@@ -6,7 +6,8 @@ CREATE TABLE IF NOT EXISTS npcs (
     personality TEXT,
     goals TEXT,
     assets TEXT,
-    memory TEXT
+    memory TEXT,
+    persona_version INTEGER NOT NULL DEFAULT 1
 );
 
 CREATE TABLE IF NOT EXISTS interactions (
@@ -14,11 +15,74 @@ CREATE TABLE IF NOT EXISTS interactions (
     npc_id INTEGER,
     player_input TEXT,
     npc_response TEXT,
-    FOREIGN KEY (npc_id) REFERENCES npcs(id)
+    persona_version INTEGER,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    thread_id INTEGER,
+    player_id TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (npc_id) REFERENCES npcs(id),
+    FOREIGN KEY (thread_id) REFERENCES threads(id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS interactions_thread_id ON interactions (thread_id, id DESC);
+CREATE INDEX IF NOT EXISTS interactions_npc_id ON interactions (npc_id, id DESC);
+
 CREATE TABLE IF NOT EXISTS game_events (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     event_description TEXT,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-); 
\ No newline at end of file
+); 
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    error TEXT,
+    cancel_requested BOOLEAN NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS npc_lines (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    npc_id INTEGER NOT NULL,
+    persona_version INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    line TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (npc_id) REFERENCES npcs(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS npc_lines_npc_version_kind ON npc_lines (npc_id, persona_version, kind);
+
+CREATE TABLE IF NOT EXISTS npc_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    npc_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    npc TEXT,
+    changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO npc_changes (npc_id, op, npc)
+SELECT n.id, 'create', json_object(
+    'id', n.id, 'name', n.name, 'background', n.background, 'appearance', n.appearance,
+    'personality', n.personality, 'goals', n.goals, 'assets', n.assets, 'memory', n.memory,
+    'persona_version', n.persona_version
+) FROM npcs n
+WHERE NOT EXISTS (SELECT 1 FROM npc_changes c WHERE c.npc_id = n.id)
+ORDER BY n.id;
+
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    npc_id INTEGER NOT NULL,
+    player_id TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_active_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (npc_id) REFERENCES npcs(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS threads_player_npc_active ON threads (player_id, npc_id, last_active_at DESC);
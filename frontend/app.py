@@ -4,6 +4,8 @@ from typing import List, Dict, Any
 import json  # Import the json module
 import re
 import os
+import hashlib
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -30,6 +32,11 @@ npc_ids = [npc.get("id", -1) for npc in npcs]
 if "previous_npc" not in st.session_state:
     st.session_state["previous_npc"] = None
 
+# Stable per-browser-session player id, so rate limits and conversation
+# history are per user rather than shared by everyone behind this server
+if "player_id" not in st.session_state:
+    st.session_state["player_id"] = str(uuid.uuid4())
+
 # NPC Creation and Editing Screen
 if page == "NPC Creation":
     st.header("Create or Edit an NPC")
@@ -152,9 +159,19 @@ if page == "NPC Creation":
                 else:
                     st.error("Failed to update NPC.")
             else:
-                # Create new NPC
-                response = requests.post(f"{BACKEND_URL}/npc/create", json=npc_data)
+                # Create new NPC; one key per creation attempt, so reruns and
+                # double submits don't create duplicates, while a new key after
+                # each success lets the same contents be created again
+                idempotency_key = st.session_state.setdefault(
+                    "create_key", str(uuid.uuid4())
+                )
+                response = requests.post(
+                    f"{BACKEND_URL}/npc/create",
+                    json=npc_data,
+                    headers={"Idempotency-Key": idempotency_key},
+                )
                 if response.status_code == 200:
+                    st.session_state["create_key"] = str(uuid.uuid4())
                     st.success("NPC created successfully!")
                 else:
                     st.error("Failed to create NPC.")
@@ -178,6 +195,26 @@ elif page == "NPC Interaction":
             # print("coming here 2")
             st.session_state["chat_history"] = []
 
+        # Open the conversation once per NPC: blank input asks the backend for
+        # the NPC's greeting (pre-generated when available) and records it
+        greeted = st.session_state.setdefault("greeted", set())
+        if npc_id not in greeted:
+            response = requests.post(
+                f"{BACKEND_URL}/npc/interact/{npc_id}",
+                json={"player_input": ""},
+                headers={
+                    "X-Player-Id": st.session_state["player_id"],
+                    "Idempotency-Key": hashlib.sha256(
+                        f"{st.session_state['player_id']}:{npc_id}:greeting".encode()
+                    ).hexdigest(),
+                },
+            )
+            if response.status_code == 200:
+                greeted.add(npc_id)
+                greeting = response.json().get("npc_response", "")
+                if greeting:
+                    st.session_state["chat_history"].append(f"{greeting}<br>")
+
         # Ensure chat history is scrollable and latest messages are visible
         chat_container = st.container()
         # print("coming here 3", st.session_state)
@@ -201,21 +238,6 @@ elif page == "NPC Interaction":
             )
             chat_history.markdown(formatted_chat, unsafe_allow_html=True)
 
-        # Fetch latest interactions with the selected NPC
-        interactions_response = requests.get(f"{BACKEND_URL}/npc/interactions/{npc_id}")
-        if interactions_response.status_code == 200:
-            interactions = interactions_response.json().get("interactions", [])
-            print("interactions LENGTH************:", len(interactions))
-            # Format last 10 interactions for the prompt
-            interaction_history = "\n".join(
-                f"You: {interaction['player_input']}\nNPC: {interaction['npc_response']}"
-                for interaction in interactions[-10:]
-            )
-        else:
-            interaction_history = ""
-
-        print("interaction_history", interaction_history)
-
         # Define a callback function to clear the input field
         def clear_input():
             player_input = st.session_state["player_input"]
@@ -226,26 +248,25 @@ elif page == "NPC Interaction":
                     "<br>".join(st.session_state["chat_history"]),
                     unsafe_allow_html=True,
                 )
-                # Include interaction history in the prompt
-                prompt = f"{interaction_history}\n"
-                # Add player details like name, background, appearance, personality, goals, and assets to the prompt
-                prompt += f"The details of the character{npc_selection} are formatted like a JSON \n"
-                prompt += f"The JSON is: {npcs[npc_names.index(npc_selection)]}"
-                prompt += f"Respond with the short, sweet response to the player's input in context of the character and interaction history"
-                prompt += f"You are {npc_selection}. Answer as if you were speaking directly, without narrating any actions or emotions."
-                # prompt += f"Respond with a JSON object with the following keys: 'npc_screenplay', 'npc_response'"
-                # prompt += f"The 'npc_screenplay' key should contain how NPC reacts to the player's input"
-                # prompt += f"The 'npc_response' key should contain the NPC's verbose response to the player's input"
-                player_input = f"\n The player's input is: {player_input}"
-                # print("prompt", prompt)
-                # print prompt length
-                # print("prompt length", len(prompt))
+                # One key per message: a rerun or resend of the same message
+                # replays the stored reply instead of asking the NPC again
+                message_seq = st.session_state.setdefault("message_seq", 0)
+                idempotency_key = hashlib.sha256(
+                    f"{st.session_state['player_id']}:{npc_id}:{message_seq}:"
+                    f"{player_input}".encode()
+                ).hexdigest()
+                # The backend builds the prompt from the NPC's persona and history
                 response = requests.post(
                     f"{BACKEND_URL}/npc/interact/{npc_id}",
-                    json={"player_input": player_input, "prompt_context": prompt},
+                    json={"player_input": player_input},
+                    headers={
+                        "X-Player-Id": st.session_state["player_id"],
+                        "Idempotency-Key": idempotency_key,
+                    },
                 )
                 print("response", response.text)
                 if response.status_code == 200:
+                    st.session_state["message_seq"] = message_seq + 1
                     # Extract the JSON string from the response
                     response_text = response.text.strip()
                     # print("response_text", response_text)
@@ -351,7 +372,7 @@ def get_npc_interactions(npc_id):
     )
 
 
-def interact_with_npc(npc_id, player_input, prompt_context):
+def interact_with_npc(npc_id, player_input, prompt_context=None):
     response = requests.post(
         f"{BACKEND_URL}/npc/interact/{npc_id}",
         json={"player_input": player_input, "prompt_context": prompt_context},